@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
+import json
+import hashlib
 from pydoc import locate
+from threading import Lock
 from collections import OrderedDict
 
 from django.contrib.admin.options import IncorrectLookupParameters
@@ -15,6 +18,7 @@ from django.utils.safestring import mark_safe
 from django.template.response import TemplateResponse
 from django.core.exceptions import PermissionDenied
 from django.db.models import Prefetch
+from django.contrib.contenttypes.models import ContentType
 from django.urls import reverse
 from django.http import HttpResponseRedirect
 
@@ -30,7 +34,47 @@ from .models import BaseMessage
 from .forms import MinkeForm
 from .forms import SessionSelectForm
 from .filters import StatusFilter
-from .utils import get_session_summary
+
+
+class SessionOptionsCache:
+    """
+    A process-local least-recently-used cache of session-options.
+
+    Options are cached by a key that reflects everything they depend on (s.
+    :meth:`.MinkeAdmin.get_session_options_key`): Among others the user's
+    permissions and the generation of the session-registry. Changed
+    permissions or a reloaded registry therefore result in new options
+    without any invalidation. The cache could be shared by multiple threads.
+    """
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._options = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, get_options):
+        """
+        Return cached options or call get_options to build them.
+        """
+        if not self.maxsize:
+            return get_options()
+
+        with self._lock:
+            try:
+                self._options.move_to_end(key)
+                return self._options[key]
+            except KeyError:
+                pass
+
+        # Build the options outside the lock - this takes some queries.
+        options = get_options()
+        with self._lock:
+            self._options[key] = options
+            while len(self._options) > self.maxsize:
+                self._options.popitem(last=False)
+        return options
+
+
+SESSION_OPTIONS = SessionOptionsCache(settings.MINKE_SESSION_OPTIONS_CACHE_SIZE)
 
 
 class SessionChangeList(ChangeList):
@@ -139,7 +183,17 @@ class MinkeChangeList(ChangeList):
         # They will be zipped with the results coming from the result_list-templatetag.
         sessions = [(list(o.sessions.all())+[None])[0] for o in self.result_list]
         self.sessions = sessions
-        self.session_count = get_session_summary([s for s in sessions if not s is None])
+        self.session_count = self.get_session_queryset(request).get_summary()
+
+    def get_session_queryset(self, request):
+        """
+        Get the current sessions of the result_list.
+        """
+        return MinkeSession.objects.filter(
+            minkeobj_type=ContentType.objects.get_for_model(self.model),
+            minkeobj_id__in=[o.pk for o in self.result_list],
+            user=request.user,
+            current=True)
 
     def get_queryset(self, request):
         qs = super().get_queryset(request)
@@ -202,12 +256,34 @@ class MinkeAdmin(admin.ModelAdmin):
         # group-permission logic.
         return permitted
 
+    def get_session_options_key(self, request):
+        """
+        Get the cache-key for the session-options of this request. The key
+        must reflect everything :meth:`.permit_session` depends on.
+        """
+        user = request.user
+        if not user.is_active:
+            perms = list()
+        elif user.is_superuser:
+            perms = True
+        else:
+            perms = sorted(user.get_all_permissions())
+        perms = hashlib.sha1(json.dumps(perms).encode()).hexdigest()
+        return user.pk, self.model, REGISTRY.generation, perms
+
     def get_session_options(self, request):
         """
         Get sessions  valid for the user and model of this request.
         Return a list of tuples like with session-name and -verbose-name.
+        The options are cached per user, model and registry-generation.
         """
+        key = self.get_session_options_key(request)
+        return SESSION_OPTIONS.get(key, lambda: self.build_session_options(request))
 
+    def build_session_options(self, request):
+        """
+        Build the session-options by checking each registered session.
+        """
         # filter and group sessions
         groups = OrderedDict()
         extra_attrs = dict()
@@ -242,7 +318,12 @@ class MinkeAdmin(admin.ModelAdmin):
         form.fields['session'].widget.extra_attrs = extra_attrs
         return form
 
-    def run_sessions(self, request, session_cls, queryset, force_confirm=False):
+    def run_sessions(self, request, session_cls, queryset, force_confirm=False, dispatch=False):
+        """
+        Run sessions on the objects of the queryset. Render the minke-form
+        first if needed. If dispatch is True the sessions are dispatched in
+        the background for the objects of the changelist (s. engine.dispatch).
+        """
         confirm = force_confirm or session_cls.confirm
         session_form_cls = session_cls.get_form()
         fabric_form_cls = None
@@ -286,6 +367,9 @@ class MinkeAdmin(admin.ModelAdmin):
             if not from_form or not valid:
                 render_params['title'] = session_cls.verbose_name,
                 render_params['minke_form'] = minke_form
+                # Do not render all objects of a select-across-request.
+                if dispatch:
+                    queryset = queryset[:self.list_max_show_all]
                 render_params['objects'] = queryset
                 render_params['object_list'] = confirm
                 return TemplateResponse(request, 'minke/minke_form.html', render_params)
@@ -298,7 +382,14 @@ class MinkeAdmin(admin.ModelAdmin):
                     runtime_data.update(session_form.cleaned_data)
 
         # lets rock...
-        engine.process(session_cls, queryset, request.user, runtime_data)
+        routing = dict(queue=settings.MINKE_ADMIN_QUEUE, priority=settings.MINKE_ADMIN_PRIORITY)
+        if dispatch:
+            url_query = request.GET.urlencode()
+            dispatch_id = engine.dispatch(
+                session_cls, self.model, request.user, url_query, runtime_data, **routing)
+            request.session['minke_dispatch'] = dispatch_id
+        else:
+            engine.process(session_cls, queryset, request.user, runtime_data, **routing)
 
     def changelist_view(self, request, extra_context=None):
         """
@@ -320,6 +411,8 @@ class MinkeAdmin(admin.ModelAdmin):
 
         # Does this request has something to do with sessions at all?
         if not 'run_sessions' in request.POST and not 'clear_sessions' in request.POST:
+            # Watch the progress of sessions dispatched in the background.
+            extra_context['minke_dispatch'] = request.session.pop('minke_dispatch', None)
             return super().changelist_view(request, extra_context)
 
         # setup
@@ -366,16 +459,16 @@ class MinkeAdmin(admin.ModelAdmin):
                 raise PermissionDenied(msg.format(session_name))
 
             # If this is a select-across-request, we force confirmation
-            # and redirect to a show-all-changelist.
-            # FIXME: select-across should be limited at least to the value of
-            # list_max_show_all.
+            # and redirect to a show-all-changelist. The sessions are
+            # dispatched in the background, since the changelist could hold
+            # far more objects than we could handle within a request.
             if select_across:
                 force_confirm = True
                 delimiter = '&' if '?' in redirect_url else '?'
                 redirect_url += delimiter + 'all='
 
             # run_sessions might want to render a minke- or session-form
-            response = self.run_sessions(request, session_cls, queryset, force_confirm)
+            response = self.run_sessions(request, session_cls, queryset, force_confirm, select_across)
             return response or HttpResponseRedirect(redirect_url)
 
 
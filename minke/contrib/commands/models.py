@@ -5,11 +5,14 @@ from django.db.models import Prefetch
 from django.contrib.contenttypes.models import ContentType
 from django.db.models.signals import pre_delete
 from django.db.models.signals import post_save
+from django.db.models.signals import post_delete
+from django.db.models.signals import m2m_changed
 from django.dispatch import receiver
 
 from minke.models import MinkeModel
 from minke.models import Host
 from minke.utils import prepare_shell_command
+from minke.sessions import REGISTRY
 
 from .sessions import BaseCommandSession
 from .sessions import BaseCommandChoiceSession
@@ -147,3 +150,20 @@ class CommandOrder(models.Model):
     def save(self, *args, **kwargs):
         self.order = self.get_order()
         super().save(*args, **kwargs)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+@receiver(m2m_changed)
+def registry_changed(sender, **kwargs):
+    """
+    Start a new registry-generation whenever command-sessions were changed.
+    """
+    senders = (
+        Command,
+        CommandGroup,
+        CommandOrder,
+        Command.minketypes.through,
+        CommandGroup.minketypes.through)
+    if sender in senders and not kwargs.get('action', '').startswith('pre_'):
+        REGISTRY.changed()
@@ -1,6 +1,5 @@
 # -*- coding: utf-8 -*-
 
-import re
 from django.dispatch import receiver
 
 from minke.sessions import CommandFormSession
@@ -57,31 +56,11 @@ def session_factory(sender, **kwargs):
     from .models import Command
     from .models import CommandGroup
 
-    # do we have a session-name and does it match our regex?
-    session_name = kwargs.get('session_name', None)
-    pattern = r'^(Command|CommandGroup)_(\d+)'
-    match = re.match(pattern, session_name or '')
-
-    # if we have no session-name, register all command-sessions
-    if not session_name:
-        for obj in Command.objects.filter(active=True):
-            session = obj.as_session()
-            session.register()
-            session.add_permission()
-            session.create_permission()
-
-        for obj in CommandGroup.objects.filter(active=True):
+    # The registry is only reloaded if commands were changed. So we register
+    # all command-sessions at once. The run-permissions are created on save
+    # (s. models.create_permission).
+    for cls in (Command, CommandGroup):
+        for obj in cls.objects.filter(active=True):
             session = obj.as_session()
             session.register()
             session.add_permission()
-            session.create_permission()
-
-    # if we have a session-name that matches, register this session only
-    elif match:
-        clsname, id = match.groups()
-        cls = Command if clsname == 'Command' else CommandGroup
-        cmd = cls.objects.get(pk=id)
-        session = cmd.as_session()
-        session.register()
-        session.add_permission()
-        session.create_permission()
@@ -1,101 +1,239 @@
 # -*- coding: utf-8 -*-
 
+import math
+import uuid
+from time import sleep
 from celery import chain
 from celery import group
+from celery.result import ResultSet
 
+from django.contrib.contenttypes.models import ContentType
+
+from . import settings
 from .messages import Message
 from .messages import ExceptionMessage
 from .models import MinkeSession
+from .models import BaseMessage
+from .models import Dispatch
 from .tasks import process_session
+from .tasks import process_host
+from .tasks import process_hosts
 from .tasks import cleanup
+from .tasks import check_rollout
+from .tasks import dispatch_sessions
+
 
+def collect_results(results, callback):
+    """
+    Call back with each session as soon as the task it belongs to is done.
 
-def process(session_cls, queryset, user, runtime_data=None, wait=False, console=False):
+    If the result-backend supports native joins (amqp, redis, cache) the
+    results are pushed by the backend. Otherwise we poll the pending results
+    in intervals of MINKE_RESULT_INTERVAL seconds.
     """
-    Initiate and run celery-tasks.
+    pending = dict((r.id, session_ids) for r, session_ids in results)
+
+    def on_ready(task_id, value=None):
+        session_ids = pending.pop(task_id, None) or list()
+        for session in MinkeSession.objects.filter(id__in=session_ids):
+            callback(session)
+
+    result_set = ResultSet([r for r, session_ids in results])
+    if result_set.supports_native_join:
+        result_set.join_native(
+            callback=on_ready,
+            propagate=False,
+            interval=settings.MINKE_RESULT_INTERVAL)
+
+    while pending:
+        ready = [r for r in result_set.results if r.id in pending and r.ready()]
+        for result in ready:
+            on_ready(result.id)
+        if pending and not ready:
+            sleep(settings.MINKE_RESULT_INTERVAL)
+
+
+def get_batches(session_cls, items):
+    """
+    Split items into batches as defined by the rollout-attributes of the
+    session-class.
+    """
+    batches = list()
+    canary = session_cls.rollout_canary
+    if canary:
+        batches.append(items[:canary])
+        items = items[canary:]
+    size = session_cls.rollout_batch_size
+    if isinstance(size, float):
+        size = math.ceil(size * (len(items) + canary))
+    size = max(size or len(items), 1)
+    batches += [items[i:i+size] for i in range(0, len(items), size)]
+    return batches
+
+
+def get_routing(session_cls, queue=None, priority=None):
+    """
+    Get the routing-options for the celery-signatures. Explicitly passed
+    values take precedence over the session-class-attributes.
+    """
+    options = dict(queue=queue or session_cls.queue)
+    options['priority'] = priority if priority is not None else session_cls.priority
+    return dict((k, v) for k, v in options.items() if v is not None)
+
+
+def get_jobs(session_cls, items, runtime_data, lock, routing):
+    """
+    Build the celery-signatures for a list of (host, sessions)-items. Return
+    a list of (signature, hosts, sessions).
+    """
+    jobs = list()
+
+    # In fanout-mode hosts are packed into tasks that process up to fanout
+    # hosts concurrently.
+    if session_cls.fanout:
+        for i in range(0, len(items), session_cls.fanout):
+            chunk = items[i:i+session_cls.fanout]
+            if session_cls.parrallel_per_host:
+                host_sessions = [(h.id, [s.id]) for h, sessions in chunk for s in sessions]
+            else:
+                host_sessions = [(h.id, [s.id for s in sessions]) for h, sessions in chunk]
+            signature = process_hosts.si(host_sessions, runtime_data, lock).set(**routing)
+            hosts = [h for h, sessions in chunk]
+            jobs.append((signature, hosts, [s for h, sessions in chunk for s in sessions]))
+        return jobs
+
+    for host, sessions in items:
+
+        # To support parrallel execution per host we wrap process_session-
+        # signatures in a group and append the cleanup-task.
+        # NOTE: The construct is essentially the same as a chord which is not
+        # supported by all result-backends (s. celery-docs).
+        if session_cls.parrallel_per_host:
+            signatures = [process_session.si(host.id, s.id, runtime_data, lock).set(**routing) for s in sessions]
+            signature = chain(group(*signatures), cleanup.si(host.id, lock).set(**routing))
+
+        # Otherwise all sessions of a host are processed by a single task.
+        else:
+            session_ids = [s.id for s in sessions]
+            signature = process_host.si(host.id, session_ids, runtime_data, lock).set(**routing)
+
+        jobs.append((signature, [host], sessions))
+    return jobs
+
+
+def get_rollout(session_cls, batches, routing):
+    """
+    Chain batches of jobs. Each batch is followed by a task that checks for
+    failed sessions before the next batch is processed.
+
+    NOTE: A group followed by a task within a chain is upgraded to a chord by
+    celery. So the rollout needs a result-backend (s. celery-docs).
+    """
+    steps = list()
+    done_ids = list()
+    jobs = [job for batch in batches for job in batch]
+    pending_ids = [s.id for signature, hosts, sessions in jobs for s in sessions]
+    for batch in batches:
+        steps.append(group(*[signature for signature, hosts, sessions in batch]))
+        batch_ids = [s.id for signature, hosts, sessions in batch for s in sessions]
+        done_ids += batch_ids
+        pending_ids = [i for i in pending_ids if i not in batch_ids]
+        if pending_ids:
+            check = check_rollout.si(list(done_ids), pending_ids, session_cls.rollout_max_failures)
+            steps.append(check.set(countdown=session_cls.rollout_pause, **routing))
+
+    hosts = [h for signature, hosts, sessions in jobs for h in hosts]
+    sessions = [s for signature, hosts, sessions in jobs for s in sessions]
+    return chain(*steps), hosts, sessions
+
+
+def process(session_cls, queryset, user, runtime_data=None, wait=False, console=False,
+            queue=None, priority=None):
+    """
+    Initiate and run celery-tasks. Tasks are routed to queue with priority
+    if given. Otherwise :attr:`.Session.queue` and :attr:`.Session.priority`
+    apply.
     """
-    # TODO: Add a MinkeSession lock. To lock the host should be optional.
     MinkeSession.objects.clear_currents(user, queryset)
-    hosts = queryset.get_hosts()
-    lock = hosts.filter(disabled=False).get_lock()
+    hosts = queryset.get_hosts().filter(disabled=False)
+    lock = hosts.get_lock(session_cls.lock_scope, session_cls.__name__)
+    locked = hosts.get_locked(lock) if lock else None
 
-    # group sessions by hosts
+    # initialize sessions and group them by hosts
+    sessions = list()
+    canceled = list()
     session_groups = dict()
-    for minkeobj in queryset.select_related_hosts():
+    for minkeobj in queryset.resolve_hosts():
         host = minkeobj.get_host()
 
         session = MinkeSession()
-        session.init(user, minkeobj, session_cls)
+        session.init(user, minkeobj, session_cls, commit=False)
+        sessions.append(session)
 
         # Skip disabled or locked hosts...
-        if host.disabled:
-            msg = f'{minkeobj}: Host is disabled.'
-            session.messages.add(Message(msg, 'error'), bulk=False)
-            session.cancel()
-            if console:
-                session.prnt()
-        elif host.lock and host.lock != lock:
-            msg = f'{minkeobj}: Host is locked.'
-            session.messages.add(Message(msg, 'error'), bulk=False)
-            session.cancel()
-            if console:
-                session.prnt()
+        if host.disabled or lock and host.id not in locked:
+            reason = 'disabled' if host.disabled else 'locked'
+            session.session_status = 'error'
+            session.proc_status = 'canceled'
+            canceled.append((session, Message(f'{minkeobj}: Host is {reason}.', 'error')))
 
         # otherwise group sessions by hosts...
         else:
+            session.lock = lock
             if host not in session_groups:
                 session_groups[host] = list()
             session_groups[host].append(session)
 
+    # save all sessions and the messages of the canceled ones in bulk
+    MinkeSession.objects.bulk_init(sessions, settings.MINKE_BULK_SIZE)
+    for session, msg in canceled:
+        msg.session = session
+    BaseMessage.objects.bulk_create([m for s, m in canceled], settings.MINKE_BULK_SIZE)
+    if console:
+        for session, msg in canceled:
+            session.prnt()
+
     # Stop here if no valid hosts are left...
     if not session_groups:
         return
 
 
-    # run celery-tasks...
-    results = list()
-    for host, sessions in session_groups.items():
+    # build celery-signatures per host...
+    routing = get_routing(session_cls, queue, priority)
+    items = list(session_groups.items())
 
-        # get process_session_signatures for all sessions
-        signatures = [process_session.si(host.id, s.id, runtime_data) for s in sessions]
-
-        # To support parrallel execution per host we wrap the signatures in a group.
-        # NOTE: Since we append the cleanup-task the construct is essentially the
-        # same as a chord which is not supported by all result-backends (s. celery-docs).
-        if session_cls.parrallel_per_host:
-            signatures = [group(*signatures)]
-
-        # append the cleanup-task
-        signatures.append(cleanup.si(host.id))
+    # In rollout-mode all jobs are chained batch by batch.
+    if session_cls.rollout_canary or session_cls.rollout_batch_size:
+        batches = get_batches(session_cls, items)
+        batches = [get_jobs(session_cls, b, runtime_data, lock, routing) for b in batches]
+        jobs = [get_rollout(session_cls, batches, routing)]
+    else:
+        jobs = get_jobs(session_cls, items, runtime_data, lock, routing)
 
+    # run celery-tasks...
+    results = list()
+    for signature, hosts, sessions in jobs:
         try:
-            result = chain(*signatures).delay()
+            result = signature.delay()
 
         # NOTE: celery-4.2.1 fails to raise an exception if rabbitmq is
         # down or no celery-worker is running at all... hope for 4.3.x
         except process_session.OperationalError:
-            host.release_lock()
+            for host in hosts:
+                if lock: host.release_lock(lock)
             for session in sessions:
-                session.add_msg(ExceptionMessage())
                 session.cancel()
-                if console: session.prnt(session)
+                session.buffer(ExceptionMessage())
+                session.flush()
+                if console: session.prnt()
 
         else:
-            results.append((result, (s.id for s in sessions)))
+            results.append((result, [s.id for s in sessions]))
 
 
     # print sessions in cli-mode as soon as they are ready...
     if console:
-        print_results = results[:]
-        while print_results:
-            # try to find a ready result...
-            try: result, session_ids = next((r for r in print_results if r[0].ready()))
-            except StopIteration: continue
-            # reload session-objects
-            sessions = MinkeSession.objects.filter(id__in=session_ids)
-            # print and remove list-item
-            for session in sessions: session.prnt()
-            print_results.remove((result, session_ids))
+        collect_results(results, MinkeSession.prnt)
 
     # evt. wait till all tasks finished...
     elif wait:
@@ -107,3 +245,43 @@ def process(session_cls, queryset, user, runtime_data=None, wait=False, console=
     for result, sessions in results:
         try: result.forget()
         except NotImplementedError: pass
+
+
+def get_progress(dispatch_id):
+    """
+    Get the progress of a dispatch as a dictionary with the keys user_id,
+    total, dispatched, done and failed. Return None for an unknown dispatch.
+    """
+    fields = ('user_id', 'total', 'dispatched', 'done', 'failed')
+    return Dispatch.objects.filter(pk=dispatch_id).values(*fields).first()
+
+
+def set_progress(dispatch_id, **progress):
+    """
+    Update the progress of a dispatch.
+    """
+    Dispatch.objects.filter(pk=dispatch_id).update(**progress)
+
+
+def dispatch(session_cls, model, user, url_query, runtime_data=None, queue=None, priority=None):
+    """
+    Run sessions on the objects of a changelist in the background.
+
+    The dispatch_sessions-task rebuilds the changelist-queryset from the
+    url-query and processes it in chunks of MINKE_DISPATCH_CHUNK_SIZE hosts.
+    Return the dispatch-id to watch the progress with :func:`.get_progress`.
+    Finished dispatches of the user are dropped beforehand.
+    """
+    Dispatch.objects.filter(user=user, done=True).delete()
+    dispatch_id = uuid.uuid4().hex
+    Dispatch.objects.create(id=dispatch_id, user=user)
+    content_type = ContentType.objects.get_for_model(model)
+    signature = dispatch_sessions.si(
+        dispatch_id, session_cls.__name__, content_type.id, user.id,
+        url_query, runtime_data, queue, priority)
+
+    try:
+        signature.set(**get_routing(session_cls, queue, priority)).delay()
+    except dispatch_sessions.OperationalError:
+        set_progress(dispatch_id, done=True, failed=True)
+    return dispatch_id
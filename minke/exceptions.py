@@ -19,6 +19,13 @@ class SessionError(Exception):
     """
 
 
+class ConcurrencyLimitReached(Exception):
+    """
+    Exception raised if a session couldn't be processed due to a concurrency
+    limit.
+    """
+
+
 class SessionRegistrationError(InvalidMinkeSetup):
     """
     Exception for failing session-registration.
@@ -34,3 +41,9 @@ class InvalidURLQuery(APIException):
     status_code = 400
     default_detail = 'Invalid url-query.'
     default_code = 'invalid_urlquery'
+
+
+class InvalidRequestData(APIException):
+    status_code = 400
+    default_detail = 'Invalid request-data.'
+    default_code = 'invalid_requestdata'
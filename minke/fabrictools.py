@@ -1,11 +1,23 @@
 
-import yaml
+import os
+import json
+import gzip
+import uuid
+import hashlib
+from time import time
+from threading import Lock
+from collections import deque
+from collections import OrderedDict
+from paramiko.ssh_exception import SSHException
 from fabric2.config import Config
 from fabric2.runners import Remote
 
 from django.conf import settings
+from django.db.models.signals import post_save
 from .exceptions import InvalidMinkeSetup
 from .models import CommandResult
+from .models import Host
+from .models import HostGroup
 
 
 class FabricConfig(Config):
@@ -31,8 +43,37 @@ class FabricConfig(Config):
       session.
     * Required defaults to make fabric work well in the deamonized context of
       minke.
+
+    Besides fabric's and invoke's own parameters minke adds two
+    run-parameters to limit the captured output of commands (see
+    :class:`.OutputBuffer`):
+
+    * ``run.output_limit``: The maximum number of characters of stdout and
+      stderr each to be kept in memory and in the database. Defaults to None,
+      which means no limit.
+    * ``run.output_dir``: A directory the full output of commands that
+      exceeded the output_limit is written to as gzip-compressed files.
+      Defaults to None, which means the exceeding output is dropped.
+
+    Both could be configured like any other parameter, e.g. by
+    ``FABRIC_RUN_OUTPUT_LIMIT`` in django's settings file, or passed to
+    :meth:`~.sessions.Session.run` for a single command.
     """
-    def __init__(self, host, session_cls, runtime_config):
+    @staticmethod
+    def global_defaults():
+        """
+        Add minke's own run-parameters to the defaults.
+        """
+        defaults = Config.global_defaults()
+        defaults['run'].update(output_limit=None, output_dir=None)
+        return defaults
+
+    def __init__(self, host=None, session_cls=None, runtime_config=None, **kwargs):
+        # Without a host we are initialized by clone().
+        if host is None:
+            super().__init__(**kwargs)
+            return
+
         super().__init__(project_location=getattr(settings, 'BASE_DIR', None), lazy=True)
         self.load_project()
         self.load_global_config()
@@ -70,7 +111,8 @@ class FabricConfig(Config):
         """
         Each :class:`~.models.HostGroup` can hold its own fabric configuration
         within the :attr:`~.models.HostGroup.config` field. The configuration
-        must be a yaml formatted associative array.
+        must be a yaml formatted associative array. It is parsed once on save
+        and loaded from :attr:`~.models.HostGroup.config_data`.
 
         The configuration of each hostgroup associated with the host to work on
         will be applied.
@@ -83,21 +125,20 @@ class FabricConfig(Config):
         :param host host: host object
         """
         for group in host.groups.all():
-            config = yaml.load(group.config, yaml.Loader)
-            self.update(config or dict())
+            self.update(group.get_config())
 
     def load_host_config(self, host):
         """
         Each :class:`~.models.Host` can hold its own fabric configuration within
         the :attr:`~.models.Host.config` field. The configuration must be a yaml
-        formatted associative array.
+        formatted associative array. It is parsed once on save and loaded from
+        :attr:`~.models.Host.config_data`.
 
         The configuration of the host to work on will be applied.
 
         :param host host: host object
         """
-        config = yaml.load(host.config, yaml.Loader)
-        self.update(config or dict())
+        self.update(host.get_config())
 
     def load_session_config(self, session_cls):
         """
@@ -177,10 +218,320 @@ class FabricConfig(Config):
         self.update(nested_config)
 
 
+class ConfigCache:
+    """
+    A worker-local least-recently-used cache of :class:`.FabricConfig` objects.
+
+    Configs are cached by host-id, the session-class and a hash of the parsed
+    configuration of the host, its hostgroups and the runtime-data. Changes
+    on hosts or hostgroups therefore result in a new config without any
+    invalidation. Saving a host or hostgroup additionally drops the affected
+    configs of the current process.
+
+    Each call returns a clone of the cached config, since connections modify
+    their config. Changes of the project's configuration file or the settings
+    won't be noticed until the process is restarted. The cache could be shared
+    by multiple threads.
+    """
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._configs = OrderedDict()
+        self._lock = Lock()
+        post_save.connect(self.invalidate, sender=Host, weak=False)
+        post_save.connect(self.invalidate, sender=HostGroup, weak=False)
+
+    def get_key(self, host, session_cls, runtime_config):
+        """
+        Return the cache-key for a host, session-class and runtime-data.
+        """
+        # The key must be based on the parsed configuration the config is
+        # built of, not on the raw one it could be out of sync with.
+        groups = [(g.id, g.get_config()) for g in host.groups.all()]
+        data = [host.get_config(), groups, runtime_config]
+        data = json.dumps(data, sort_keys=True, default=repr)
+        return host.id, session_cls, hashlib.sha1(data.encode()).hexdigest()
+
+    def get(self, host, session_cls, runtime_config):
+        """
+        Return a cached config or create a new one.
+        """
+        if not self.maxsize:
+            return FabricConfig(host, session_cls, runtime_config)
+
+        key = self.get_key(host, session_cls, runtime_config)
+        with self._lock:
+            try:
+                self._configs.move_to_end(key)
+            except KeyError:
+                self._configs[key] = FabricConfig(host, session_cls, runtime_config)
+                while len(self._configs) > self.maxsize:
+                    self._configs.popitem(last=False)
+            config = self._configs[key]
+
+        # Connections write into their config (e.g. connect_kwargs). So each
+        # of them gets a clone of its own.
+        return config.clone()
+
+    def invalidate(self, sender=None, instance=None, **kwargs):
+        """
+        Drop all configs of a saved host. Drop all configs at all if a
+        hostgroup was saved or no instance was given.
+        """
+        with self._lock:
+            if sender is Host and instance is not None:
+                for key in [k for k in self._configs if k[0] == instance.id]:
+                    del self._configs[key]
+            else:
+                self._configs.clear()
+
+
+class OutputBuffer:
+    """
+    A capture-buffer for command-output with a size-limit.
+
+    The first and the last half of ``limit`` characters of the output are kept
+    in memory. Everything between is dropped and replaced by a short note. If
+    a ``path`` is given, the full output is written to a gzip-compressed file
+    as soon as the limit is exceeded.
+
+    Watchers (e.g. the sudo-password-responder) track their position within
+    the whole output. So for ``watched`` output the uncapped stream is kept
+    in memory as well and passed to the watchers instead.
+
+    The buffer implements the part of the list-api invoke's runner uses for
+    its capture-buffers.
+    """
+    def __init__(self, limit, path=None, watched=False):
+        self.limit = limit
+        self.path = path
+        self.stream = list() if watched else None
+        self.file = None
+        self.head = list()
+        self.tail = deque()
+        self.size = 0
+        self.head_size = 0
+        self.tail_size = 0
+        self.dropped = 0
+
+    def append(self, data):
+        """
+        Add output-data.
+        """
+        if self.path and not self.file and self.size + len(data) > self.limit:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.file = gzip.open(self.path, 'wt', encoding='utf-8', errors='replace')
+            self.file.writelines(self.head + list(self.tail))
+        if self.file:
+            self.file.write(data)
+        if self.stream is not None:
+            self.stream.append(data)
+        self.size += len(data)
+
+        head_space = self.limit // 2 - self.head_size
+        if head_space > 0:
+            self.head.append(data[:head_space])
+            self.head_size += len(self.head[-1])
+            data = data[head_space:]
+        if data:
+            self.tail.append(data)
+            self.tail_size += len(data)
+            self.truncate(self.limit - self.limit // 2)
+
+    def truncate(self, tail_size):
+        """
+        Drop the oldest data of the tail exceeding tail_size.
+        """
+        while self.tail_size > tail_size:
+            data = self.tail.popleft()
+            excess = self.tail_size - tail_size
+            if len(data) > excess:
+                self.tail.appendleft(data[excess:])
+                excess_size = excess
+            else:
+                excess_size = len(data)
+            self.tail_size -= excess_size
+            self.dropped += excess_size
+
+    def close(self):
+        """
+        Close the file the output was written to.
+        """
+        if self.file:
+            self.file.close()
+
+    @property
+    def spilled(self):
+        """
+        True if the output was written to a file.
+        """
+        return self.file is not None
+
+    def __iter__(self):
+        yield from self.head
+        if self.dropped:
+            if self.spilled:
+                note = '\n[... {} characters omitted - see {} ...]\n'
+                yield note.format(self.dropped, self.path)
+            else:
+                note = '\n[... {} characters omitted ...]\n'
+                yield note.format(self.dropped)
+        yield from self.tail
+
+
 class FabricRemote(Remote):
     """
     A subclass of fabric's remote-runner to customize the result-class.
+
+    If a ``run.output_limit`` is configured the output is captured by an
+    :class:`.OutputBuffer`. Commands with watchers keep their full output in
+    memory for the watchers nevertheless.
     """
+    def _handle_output_limited(self, handler, name, buffer_, *args, **kwargs):
+        limit = self.opts.get('output_limit')
+        if not limit:
+            return handler(buffer_, *args, **kwargs)
+
+        path = None
+        if self.opts.get('output_dir'):
+            filename = '{}.{}.gz'.format(uuid.uuid4().hex, name)
+            path = os.path.join(self.opts['output_dir'], filename)
+        output = OutputBuffer(limit, path, watched=bool(self.watchers))
+        try:
+            handler(output, *args, **kwargs)
+        finally:
+            output.close()
+            # The main-thread works with the original buffer.
+            buffer_.extend(output)
+            if output.spilled:
+                self.output_files[name] = output.path
+
+    def respond(self, buffer_):
+        # Watchers need the uncapped output-stream.
+        if isinstance(buffer_, OutputBuffer) and buffer_.stream is not None:
+            buffer_ = buffer_.stream
+        return super().respond(buffer_)
+
+    def handle_stdout(self, buffer_, *args, **kwargs):
+        handler = super().handle_stdout
+        return self._handle_output_limited(handler, 'stdout', buffer_, *args, **kwargs)
+
+    def handle_stderr(self, buffer_, *args, **kwargs):
+        handler = super().handle_stderr
+        return self._handle_output_limited(handler, 'stderr', buffer_, *args, **kwargs)
+
+    def start(self, *args, **kwargs):
+        self.output_files = dict()
+        return super().start(*args, **kwargs)
+
     def generate_result(self, **kwargs):
         kwargs["connection"] = self.context
-        return CommandResult(**kwargs)
+        result = CommandResult(**kwargs)
+        for name, path in getattr(self, 'output_files', dict()).items():
+            setattr(result, name + '_file', path)
+        return result
+
+
+class ConnectionPool:
+    """
+    A worker-local pool of authenticated ssh-clients.
+
+    Clients are pooled by host, user, port and a hash of the connect-related
+    configuration of the :class:`~fabric.connection.Connection` they were
+    opened by. A connection passed to :meth:`.connect` reuses a pooled client
+    with the same key as long as the client is still healthy and was not idle
+    for more than ``idle_timeout`` seconds. An ``idle_timeout`` of 0 disables
+    pooling.
+
+    Stale clients are only closed whenever the pool is used - there is no
+    timer. So an idle worker keeps its pooled ssh-transports open until it
+    processes its next session or is shut down. Use :meth:`.reap` or
+    :meth:`.clear` to close them explicitly.
+
+    Connections with agent-forwarding are never pooled. The pool could be
+    shared by multiple threads.
+    """
+    def __init__(self, idle_timeout=0):
+        self.idle_timeout = idle_timeout
+        self._clients = dict()
+        self._lock = Lock()
+
+    def get_key(self, con):
+        """
+        Return the pool-key for a connection.
+        """
+        config = [con.connect_kwargs, con.connect_timeout, str(con.gateway)]
+        config = json.dumps(config, sort_keys=True, default=repr)
+        return con.host, con.user, con.port, hashlib.sha1(config.encode()).hexdigest()
+
+    def is_healthy(self, client):
+        """
+        Check if the client's transport is still alive.
+        """
+        transport = client.get_transport()
+        if not transport or not transport.is_active():
+            return False
+        try:
+            transport.send_ignore()
+        except (SSHException, EOFError, OSError):
+            return False
+        return True
+
+    def reap(self):
+        """
+        Close all clients that were idle for too long.
+        """
+        now = time()
+        stale = list()
+        with self._lock:
+            for key, (client, released) in list(self._clients.items()):
+                if now - released > self.idle_timeout:
+                    del self._clients[key]
+                    stale.append(client)
+        for client in stale:
+            client.close()
+
+    def clear(self):
+        """
+        Close all pooled clients.
+        """
+        with self._lock:
+            clients = [c for c, released in self._clients.values()]
+            self._clients.clear()
+        for client in clients:
+            client.close()
+
+    def connect(self, con):
+        """
+        Let the connection use a pooled client if there is a healthy one.
+        """
+        self.reap()
+        # Once popped from the pool the client is owned by this connection.
+        with self._lock:
+            client, released = self._clients.pop(self.get_key(con), (None, None))
+        if client and self.is_healthy(client):
+            con.client = client
+            con.transport = client.get_transport()
+        elif client:
+            client.close()
+        return con
+
+    def release(self, con):
+        """
+        Give the connection's client back to the pool or close it.
+        """
+        if not self.idle_timeout or con.forward_agent or not con.is_connected:
+            con.close()
+        elif not self.is_healthy(con.client):
+            con.close()
+        else:
+            # sftp-sessions are bound to the connection-object
+            if getattr(con, '_sftp', None) is not None:
+                con._sftp.close()
+                con._sftp = None
+            key = self.get_key(con)
+            with self._lock:
+                replaced = self._clients.pop(key, (None, None))[0]
+                self._clients[key] = (con.client, time())
+            if replaced:
+                replaced.close()
+        self.reap()
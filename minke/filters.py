@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 
 from django.contrib import admin
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Exists
+from django.db.models import OuterRef
 from django.utils.translation import gettext_lazy as _
 from .models import MinkeSession
 
@@ -14,12 +17,14 @@ class StatusFilter(admin.SimpleListFilter):
 
     def __init__(self, request, params, model, model_admin):
         super().__init__(request, params, model, model_admin)
-        self.states = (s[0] for s in MinkeSession.SESSION_STATES)
-        qs = model_admin.get_queryset(request)
-        self.sessions = MinkeSession.objects.get_currents(request.user, qs)
+        self.states = tuple(s[0] for s in MinkeSession.SESSION_STATES)
+        self.sessions = MinkeSession.objects.filter(
+            minkeobj_type=ContentType.objects.get_for_model(model),
+            user=request.user,
+            current=True)
 
     def has_output(self):
-        return bool(self.sessions)
+        return self.sessions.exists()
 
     def values(self):
         return self.value().split(',') if self.value() else list()
@@ -27,12 +32,13 @@ class StatusFilter(admin.SimpleListFilter):
     def queryset(self, request, queryset):
         if not self.value(): return queryset
 
-        ids = list()
-        for status in self.values():
-            for session in self.sessions.all():
-                if not session.session_status == status: continue
-                ids.append(session.minkeobj_id)
-        return queryset.filter(id__in=ids)
+        # Filter by a correlated subquery which is covered by the index on
+        # current sessions.
+        sessions = self.sessions.filter(
+            minkeobj_id=OuterRef('pk'),
+            session_status__in=self.values())
+        queryset = queryset.annotate(minkestatus_exists=Exists(sessions))
+        return queryset.filter(minkestatus_exists=True)
 
     def choices(self, changelist):
         yield {
@@ -7,6 +7,7 @@ from django.core.management.base import BaseCommand
 from django.core.management.base import CommandError
 
 from ...models import Host
+from ...models import HostLock
 from ...models import MinkeSession
 from ...sessions import REGISTRY
 
@@ -19,6 +20,10 @@ class Command(BaseCommand):
             '-L', '--release-locks',
             action='store_true',
             help='Release locks on all hosts.')
+        parser.add_argument(
+            '-E', '--release-expired-locks',
+            action='store_true',
+            help='Release expired locks.')
         parser.add_argument(
             '-C', '--clear-current-sessions',
             action='store_true',
@@ -53,7 +58,11 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         if options['release_locks']:
-            print(Host.objects.update(lock=None))
+            print(Host.objects.update(lock=None, lock_expires=None))
+            print(HostLock.objects.all().delete()[0])
+
+        if options['release_expired_locks']:
+            print(Host.objects.reap_locks())
 
         if options['clear_current_sessions']:
             print(MinkeSession.objects.update(current=False))
@@ -88,12 +97,8 @@ class Command(BaseCommand):
 
         if options['create_run_permissions']:
             REGISTRY.reload()
-            for session_cls in REGISTRY.values():
-                if not session_cls.auto_permission:
-                    continue
-                permission, created = session_cls.create_permission()
-                if created:
-                    print('Created permission: {}'.format(permission))
+            for permission in REGISTRY.create_permissions():
+                print('Created permission: {}'.format(permission))
 
         if options['delete_run_permissions']:
             print(Permission.objects.filter(codename__startswith='run_').delete())
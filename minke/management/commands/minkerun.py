@@ -12,6 +12,7 @@ from ... import settings
 from ...engine import process
 from ...sessions import REGISTRY
 from ...utils import item_by_attr
+from ...utils import get_changelist_queryset
 
 
 class Command(BaseCommand):
@@ -44,6 +45,13 @@ class Command(BaseCommand):
         parser.add_argument(
             '-u', '--user',
             help='User to work with.')
+        parser.add_argument(
+            '--queue',
+            help='Celery-queue to route the session-tasks to.')
+        parser.add_argument(
+            '--priority',
+            type=int,
+            help='Priority of the session-tasks.')
         parser.add_argument(
             '-s', '--list-sessions',
             action='store_true',
@@ -134,28 +142,12 @@ class Command(BaseCommand):
         return queryset
 
     def get_changelist_queryset(self, options, model_cls, user):
-        from django.contrib import admin
-        from django.test import RequestFactory
-        from django.urls import reverse
-
         url_query = options['url_query']
-
-        # get a request-instance with session-middleware
-        model_label = model_cls._meta.label_lower.replace('.', '_')
-        url_pattern = 'admin:' + model_label + '_changelist'
-        url = reverse(url_pattern) + '?' + url_query
-        request_factory = RequestFactory()
-        request = request_factory.get(url)
-        request.user = user
-
-        # get a changelist and return its queryset
-        modeladmin = admin.site._registry[model_cls]
         try:
-            changelist = modeladmin.get_changelist_instance(request)
+            return get_changelist_queryset(model_cls, user, url_query)
         except (IncorrectLookupParameters, FieldError):
             msg = 'Invalid url-query: {}'.format(url_query)
             raise CommandError(msg)
-        return changelist.get_queryset(request)
 
     def get_form_data(self, options, session_cls):
         form_cls = session_cls.get_form()
@@ -232,4 +224,5 @@ class Command(BaseCommand):
         if options['list_items']:
             for obj in queryset: print(obj)
         else:
-            process(session_cls, queryset, user, form_data, console=True)
+            process(session_cls, queryset, user, form_data, console=True,
+                    queue=options['queue'], priority=options['priority'])
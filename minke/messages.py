@@ -18,7 +18,10 @@ class Message(ProxyMixin, BaseMessage):
     def __init__(self, data, level=None):
         super().__init__()
         self.text = self.get_text(data)
-        self.html = self.get_html(data)
+        # Html that equals the rendered text is not stored but rendered on
+        # access. See BaseMessage.html.
+        if type(self).get_html is not PreMessage.get_html:
+            self.html = self.get_html(data)
         self.level = self.get_level(data, level)
 
     def get_level(self, data, level):
@@ -53,11 +56,7 @@ class Message(ProxyMixin, BaseMessage):
 
 class PreMessage(Message):
     def get_html(self, data):
-        data = self.get_text(data)
-        wrapped = list()
-        for line in data.splitlines():
-            wrapped += textwrap.wrap(line, MINKE_MESSAGE_WRAP)
-        return '<pre>{}</pre>'.format(escape('\n'.join(wrapped)))
+        return self.render_html(self.get_text(data))
 
 
 class TableMessage(PreMessage):
@@ -0,0 +1,33 @@
+# Generated by Django 2.2.28 on 2026-10-17 10:12
+
+from django.db import migrations
+import minke.utils
+
+
+def parse_configs(apps, schema_editor):
+    for model_name in ('Host', 'HostGroup'):
+        model = apps.get_model('minke', model_name)
+        for obj in model.objects.exclude(config=''):
+            obj.config_data = minke.utils.load_yaml_configuration(obj.config)
+            obj.save(update_fields=['config_data'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('minke', '0009_remove_minkesession_session_data'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='host',
+            name='config_data',
+            field=minke.utils.JSONField(blank=True, editable=False, help_text='The parsed fabric/invoke configuration.', null=True, verbose_name='Parsed configuration'),
+        ),
+        migrations.AddField(
+            model_name='hostgroup',
+            name='config_data',
+            field=minke.utils.JSONField(blank=True, editable=False, help_text='The parsed fabric/invoke configuration.', null=True, verbose_name='Parsed configuration'),
+        ),
+        migrations.RunPython(parse_configs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.2.28 on 2026-10-17 19:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('minke', '0010_config_data'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='basemessage',
+            index=models.Index(fields=['session', 'created_time'], name='minke_message_session_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='commandresult',
+            index=models.Index(fields=['session', 'created_time'], name='minke_command_session_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='minkesession',
+            index=models.Index(fields=['minkeobj_type', 'minkeobj_id', 'user', 'current'], name='minke_session_current_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='minkesession',
+            index=models.Index(fields=['created_time'], name='minke_session_created_idx'),
+        ),
+    ]
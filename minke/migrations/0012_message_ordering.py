@@ -0,0 +1,21 @@
+# Generated by Django 2.2.28 on 2026-10-17 20:02
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('minke', '0011_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='basemessage',
+            options={'ordering': ('session_id', 'created_time', 'id'), 'verbose_name': 'Message', 'verbose_name_plural': 'Messages'},
+        ),
+        migrations.AlterModelOptions(
+            name='commandresult',
+            options={'ordering': ('session_id', 'created_time', 'id'), 'verbose_name': 'Command-Result', 'verbose_name_plural': 'Command-Results'},
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-17 20:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('minke', '0012_message_ordering'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='commandresult',
+            name='stderr_file',
+            field=models.CharField(blank=True, help_text='File holding the full standard-error if it exceeded the output-limit.', max_length=255, null=True, verbose_name='Stderr-file'),
+        ),
+        migrations.AddField(
+            model_name='commandresult',
+            name='stdout_file',
+            field=models.CharField(blank=True, help_text='File holding the full standard-output if it exceeded the output-limit.', max_length=255, null=True, verbose_name='Stdout-file'),
+        ),
+    ]
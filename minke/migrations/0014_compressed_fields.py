@@ -0,0 +1,47 @@
+from django.db import migrations
+import minke.utils
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('minke', '0013_output_files'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='basemessage',
+            name='html',
+            field=minke.utils.CompressedTextField(blank=True, help_text='Message as HTML (unless it is rendered from the text).', null=True, verbose_name='HTML'),
+        ),
+        # Keep the html-column but rename the field.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.RenameField(
+                    model_name='basemessage',
+                    old_name='html',
+                    new_name='html_data',
+                ),
+                migrations.AlterField(
+                    model_name='basemessage',
+                    name='html_data',
+                    field=minke.utils.CompressedTextField(blank=True, db_column='html', help_text='Message as HTML (unless it is rendered from the text).', null=True, verbose_name='HTML'),
+                ),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='basemessage',
+            name='text',
+            field=minke.utils.CompressedTextField(help_text='Message-Text', verbose_name='Text'),
+        ),
+        migrations.AlterField(
+            model_name='commandresult',
+            name='stderr',
+            field=minke.utils.CompressedTextField(blank=True, help_text='Standard-error of the command. (unless the process was invoked via a pty, in which case stderr and stdout are merged into stdout)', null=True, verbose_name='Stderr'),
+        ),
+        migrations.AlterField(
+            model_name='commandresult',
+            name='stdout',
+            field=minke.utils.CompressedTextField(blank=True, help_text='Standard-output of the command.', null=True, verbose_name='Stdout'),
+        ),
+    ]
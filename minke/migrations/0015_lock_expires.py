@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-17 20:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('minke', '0014_compressed_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='host',
+            name='lock_expires',
+            field=models.DateTimeField(blank=True, help_text='Locks are leased and renewed while sessions are running. Expired locks are released. Locks without expiry-time never expire.', null=True, verbose_name='Lock expires'),
+        ),
+    ]
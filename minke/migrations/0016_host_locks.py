@@ -0,0 +1,29 @@
+# Generated by Django 2.2.28 on 2026-10-17 20:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('minke', '0015_lock_expires'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HostLock',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(blank=True, help_text='The session-name for locks with session-scope. Empty for locks with host-scope.', max_length=128, verbose_name='Key')),
+                ('lock', models.CharField(help_text='Identifies the process holding the lock.', max_length=20, verbose_name='Lock')),
+                ('expires', models.DateTimeField(help_text='Locks are leased and renewed while sessions are running.', verbose_name='Expires')),
+                ('host', models.ForeignKey(help_text='The locked host.', on_delete=django.db.models.deletion.CASCADE, related_name='locks', to='minke.Host', verbose_name='Host')),
+            ],
+            options={
+                'verbose_name': 'Host-Lock',
+                'verbose_name_plural': 'Host-Locks',
+                'unique_together': {('host', 'key')},
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.2.28 on 2026-10-17 20:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('minke', '0016_host_locks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hostgroup',
+            name='max_sessions',
+            field=models.PositiveIntegerField(blank=True, help_text='Maximum number of sessions processed concurrently on the hosts of this group.', null=True, verbose_name='Max. sessions'),
+        ),
+        migrations.CreateModel(
+            name='SessionSlot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(help_text='Identifies the concurrency-limit.', max_length=255, verbose_name='Key')),
+                ('number', models.PositiveIntegerField(help_text='Number of the slot.', verbose_name='Number')),
+                ('holder', models.CharField(help_text='Identifies the process holding the slot.', max_length=32, verbose_name='Holder')),
+                ('expires', models.DateTimeField(help_text='Slots are leased and renewed while sessions are running.', verbose_name='Expires')),
+            ],
+            options={
+                'verbose_name': 'Session-Slot',
+                'verbose_name_plural': 'Session-Slots',
+                'unique_together': {('key', 'number')},
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 2.2.28 on 2026-10-17 20:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('minke', '0017_session_slots'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='minkesession',
+            name='lock',
+            field=models.CharField(blank=True, help_text="The lock held for the session's host. The lock is kept as long as the session is waiting to be processed.", max_length=20, null=True, verbose_name='Host-lock'),
+        ),
+        migrations.AddIndex(
+            model_name='minkesession',
+            index=models.Index(fields=['lock', 'proc_status'], name='minke_session_lock_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.2.28 on 2026-10-17 20:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('minke', '0018_session_lock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RegistryGeneration',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('generation', models.CharField(help_text='Changes whenever dynamic sessions have to be reloaded.', max_length=32, verbose_name='Generation')),
+            ],
+            options={
+                'verbose_name': 'Registry-Generation',
+                'verbose_name_plural': 'Registry-Generations',
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 2.2.28 on 2026-10-17 20:40
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('minke', '0019_registry_generation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Dispatch',
+            fields=[
+                ('id', models.CharField(max_length=32, primary_key=True, serialize=False, verbose_name='Dispatch-ID')),
+                ('total', models.PositiveIntegerField(blank=True, help_text='Number of objects to run sessions on.', null=True, verbose_name='Total')),
+                ('dispatched', models.PositiveIntegerField(default=0, help_text='Number of objects sessions were dispatched for.', verbose_name='Dispatched')),
+                ('done', models.BooleanField(default=False, verbose_name='Done')),
+                ('failed', models.BooleanField(default=False, verbose_name='Failed')),
+                ('created_time', models.DateTimeField(auto_now_add=True, verbose_name='Created-time')),
+                ('user', models.ForeignKey(help_text='User that dispatched the sessions.', on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'verbose_name': 'Dispatch',
+                'verbose_name_plural': 'Dispatches',
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 2.2.28 on 2026-10-17 20:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('minke', '0020_dispatch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='minkesession',
+            name='run_id',
+            field=models.CharField(blank=True, help_text='Identifies the sessions initialized together.', max_length=32, null=True, verbose_name='Run-ID'),
+        ),
+        migrations.AddIndex(
+            model_name='minkesession',
+            index=models.Index(fields=['run_id'], name='minke_session_run_idx'),
+        ),
+    ]
@@ -2,24 +2,33 @@
 
 import re
 import os
+import uuid
 import signal
+import textwrap
 import datetime
 from time import time
 from fabric2.runners import Result
 
 from django.db import models
+from django.db.models import Q
+from django.db.models import F
 from django.db import transaction
+from django.db import IntegrityError
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.fields import GenericRelation
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import FieldError
+from django.utils.html import escape
 from django.utils.translation import gettext
 from django.utils.translation import gettext_lazy as _
 
+from . import settings
 from .exceptions import InvalidMinkeSetup
 from .utils import JSONField
+from .utils import CompressedTextField
 from .utils import valid_yaml_configuration
+from .utils import load_yaml_configuration
 
 
 class MinkeSessionQuerySet(models.QuerySet):
@@ -41,8 +50,79 @@ class MinkeSessionQuerySet(models.QuerySet):
         """
         return self.get_currents(user, minkeobjs).update(current=False)
 
+    def get_summary(self):
+        """
+        Count sessions by their states within a single query.
+        """
+        return self.aggregate(
+            all=models.Count('id'),
+            waiting=models.Count('id', filter=Q(proc_status='initialized')),
+            running=models.Count('id', filter=Q(proc_status__in=('running', 'stopping'))),
+            done=models.Count('id', filter=Q(proc_status__in=('completed', 'stopped', 'canceled', 'failed'))),
+            success=models.Count('id', filter=Q(session_status='success')),
+            warning=models.Count('id', filter=Q(session_status='warning')),
+            error=models.Count('id', filter=Q(session_status='error')),
+        )
+
+    def get_updates(self, known):
+        """
+        Get sessions that changed compared to the known states.
+
+        Known states are passed as a dictonary that maps session-ids to tuples
+        of the proc-status and the id of the last known message. Only sessions
+        with a different proc-status or newer messages are returned. Those new
+        messages are set as new_messages-attribute on each session.
+        """
+        sessions = dict((s.id, s) for s in self.filter(id__in=known))
+        if not sessions:
+            return list()
+        for session in sessions.values():
+            session.new_messages = list()
+
+        # Fetch the new messages of all sessions at once. Sessions are grouped
+        # by the id of their last known message - so only unknown messages are
+        # loaded.
+        cursors = dict()
+        for session_id in sessions:
+            cursors.setdefault(known[session_id][1], list()).append(session_id)
+        lookup = Q()
+        for msg_id, session_ids in cursors.items():
+            lookup |= Q(session_id__in=session_ids, id__gt=msg_id)
+        for msg in BaseMessage.objects.filter(lookup).order_by('id'):
+            sessions[msg.session_id].new_messages.append(msg)
+
+        return [s for s in sessions.values()
+                if s.new_messages or s.proc_status != known[s.id][0]]
+
+    def bulk_init(self, sessions, batch_size=None):
+        """
+        Save initialized sessions in batches using bulk-inserts.
+
+        Only some database-backends return the primary-keys of bulk-inserted
+        rows. For all others we fetch them afterwards by a run-id, that marks
+        all sessions of this call.
+        """
+        run_id = uuid.uuid4().hex
+        for session in sessions:
+            session.run_id = run_id
+        batch_size = batch_size or len(sessions) or 1
+        for i in range(0, len(sessions), batch_size):
+            batch = sessions[i:i + batch_size]
+            self.bulk_create(batch)
+            if all(s.pk for s in batch):
+                continue
+
+            rows = self.filter(
+                run_id=run_id,
+                minkeobj_type_id__in=set(s.minkeobj_type_id for s in batch),
+                minkeobj_id__in=[s.minkeobj_id for s in batch])
+            rows = rows.values_list('minkeobj_type_id', 'minkeobj_id', 'id')
+            ids = dict(((t, o), id) for t, o, id in rows)
+            for session in batch:
+                session.id = ids[(session.minkeobj_type_id, session.minkeobj_id)]
+        return sessions
+
 
-# TODO: Add indexes for sessions, messages and commandresults!
 class MinkeSession(models.Model):
     """
     The MinkeSession holds the data of any executed session and tracks its process.
@@ -78,6 +158,23 @@ class MinkeSession(models.Model):
 
     class Meta:
         ordering = ('minkeobj_type_id', 'minkeobj_id', '-created_time')
+        # NOTE: A partial index on current=True is not used by sqlite for
+        # parametrized queries and not supported by mysql at all. So we go
+        # with a composite index for get_currents and clear_currents.
+        indexes = [
+            models.Index(
+                fields=['minkeobj_type', 'minkeobj_id', 'user', 'current'],
+                name='minke_session_current_idx'),
+            models.Index(
+                fields=['created_time'],
+                name='minke_session_created_idx'),
+            models.Index(
+                fields=['lock', 'proc_status'],
+                name='minke_session_lock_idx'),
+            models.Index(
+                fields=['run_id'],
+                name='minke_session_run_idx'),
+        ]
         verbose_name = _('Session')
         verbose_name_plural = _('Sessions')
 
@@ -134,13 +231,23 @@ class MinkeSession(models.Model):
         verbose_name=_("Created-time"),
         help_text=_('Time the session has been initiated.'))
     current = models.BooleanField(default=True)
+    lock = models.CharField(
+        max_length=20, blank=True, null=True,
+        verbose_name=_("Host-lock"),
+        help_text=_('The lock held for the session\'s host. The lock is kept '
+                    'as long as the session is waiting to be processed.'))
+    run_id = models.CharField(
+        max_length=32, blank=True, null=True,
+        verbose_name=_("Run-ID"),
+        help_text=_('Identifies the sessions initialized together.'))
 
     def __str__(self):
         return f'{self.session_name} on {self.minkeobj}'
 
-    def init(self, user, minkeobj, session_cls):
+    def init(self, user, minkeobj, session_cls, commit=True):
         """
         Initialize a session. Setup the session-attributes and save it.
+        Pass commit=False to skip saving, e.g. to use bulk_init afterwards.
         """
         self.proc_status = 'initialized'
         self.user = user
@@ -148,7 +255,8 @@ class MinkeSession(models.Model):
         self.session_name = session_cls.__name__
         self.session_verbose_name = session_cls.verbose_name
         self.session_description = session_cls.__doc__
-        self.save()
+        if commit:
+            self.save()
 
     @transaction.atomic
     def start(self):
@@ -190,6 +298,41 @@ class MinkeSession(models.Model):
         elif session.is_stopping:
             os.kill(session.pid, signal.SIGUSR1)
 
+    def buffer(self, obj):
+        """
+        Add a message or command-result to the write-buffer of the session.
+
+        Buffered objects are saved in bulk. The buffer is flushed if it holds
+        MINKE_BUFFER_SIZE objects, if the last flush was more than
+        MINKE_BUFFER_INTERVAL seconds ago, before a remote-command is run and
+        at the end of the session.
+        """
+        obj.session = self
+        self._buffer = getattr(self, '_buffer', list())
+        self._buffer.append(obj)
+        self.flush(force=len(self._buffer) >= settings.MINKE_BUFFER_SIZE)
+
+    def flush(self, force=True):
+        """
+        Save all buffered messages and command-results.
+
+        Parameters
+        ----------
+        force : bool (optional)
+            If False the buffer is only flushed if the last flush was more than
+            MINKE_BUFFER_INTERVAL seconds ago.
+        """
+        buffer = getattr(self, '_buffer', None)
+        flushed = getattr(self, '_flushed', 0)
+        if not buffer or not force and time() - flushed < settings.MINKE_BUFFER_INTERVAL:
+            return
+        messages = [o for o in buffer if isinstance(o, BaseMessage)]
+        commands = [o for o in buffer if isinstance(o, CommandResult)]
+        BaseMessage.objects.bulk_create(messages)
+        CommandResult.objects.bulk_create(commands)
+        self._buffer = list()
+        self._flushed = time()
+
     @transaction.atomic
     def end(self, failure=False):
         """
@@ -198,6 +341,7 @@ class MinkeSession(models.Model):
         processing, the start-, end- and cancel-method are each wrapped within a
         atomic transaction using select_for_update to protect them from interfering.
         """
+        self.flush()
         session = MinkeSession.objects.select_for_update().get(pk=self.id)
         if failure:
             self.session_status = 'error'
@@ -292,16 +436,26 @@ class CommandResult(Result, models.Model):
     exited = models.SmallIntegerField(
         verbose_name=_('Exit-status'),
         help_text=_('Exit-status returned by the command.'))
-    stdout = models.TextField(
+    stdout = CompressedTextField(
         blank=True, null=True,
         verbose_name=_('Stdout'),
         help_text=_('Standard-output of the command.'))
-    stderr = models.TextField(
+    stderr = CompressedTextField(
         blank=True, null=True,
         verbose_name=_('Stderr'),
         help_text=_('Standard-error of the command. '
                     '(unless the process was invoked via a pty, '
                     'in which case stderr and stdout are merged into stdout)'))
+    stdout_file = models.CharField(
+        max_length=255, blank=True, null=True,
+        verbose_name=_('Stdout-file'),
+        help_text=_('File holding the full standard-output '
+                    'if it exceeded the output-limit.'))
+    stderr_file = models.CharField(
+        max_length=255, blank=True, null=True,
+        verbose_name=_('Stderr-file'),
+        help_text=_('File holding the full standard-error '
+                    'if it exceeded the output-limit.'))
     shell = models.CharField(
         max_length=128,
         verbose_name=_('Shell'),
@@ -324,7 +478,12 @@ class CommandResult(Result, models.Model):
         help_text=_('Session whereas this command where executed.'))
 
     class Meta:
-        ordering = ('session_id', 'created_time')
+        ordering = ('session_id', 'created_time', 'id')
+        indexes = [
+            models.Index(
+                fields=['session', 'created_time'],
+                name='minke_command_session_idx'),
+        ]
         verbose_name = _('Command-Result')
         verbose_name_plural = _('Command-Results')
 
@@ -420,22 +579,52 @@ class BaseMessage(models.Model):
         choices=LEVELS,
         verbose_name=_('Message-level'),
         help_text=_('Level with which the message were added.'))
-    text = models.TextField(
+    text = CompressedTextField(
         verbose_name=_('Text'),
         help_text=_('Message-Text'))
-    html = models.TextField(
+    html_data = CompressedTextField(
+        db_column='html',
+        blank=True, null=True,
         verbose_name=_('HTML'),
-        help_text=_('Message as HTML'))
+        help_text=_('Message as HTML (unless it is rendered from the text).'))
     created_time = models.DateTimeField(
         auto_now_add=True,
         verbose_name=_('Time of creation'),
         help_text=_('The datetime this message were added.'))
 
     class Meta:
-        ordering = ('session_id', 'created_time')
+        ordering = ('session_id', 'created_time', 'id')
+        indexes = [
+            models.Index(
+                fields=['session', 'created_time'],
+                name='minke_message_session_idx'),
+        ]
         verbose_name = _('Message')
         verbose_name_plural = _('Messages')
 
+    @property
+    def html(self):
+        """
+        The message as html. Messages that don't render their own html are
+        rendered from their text on access.
+        """
+        if self.html_data is None:
+            return self.render_html(self.text)
+        return self.html_data
+
+    @html.setter
+    def html(self, value):
+        self.html_data = value
+
+    def render_html(self, text):
+        """
+        Render text as wrapped and preformatted html.
+        """
+        wrapped = list()
+        for line in text.splitlines():
+            wrapped += textwrap.wrap(line, settings.MINKE_MESSAGE_WRAP)
+        return '<pre>{}</pre>'.format(escape('\n'.join(wrapped)))
+
 
 class HostGroup(models.Model):
     """
@@ -455,6 +644,16 @@ class HostGroup(models.Model):
         verbose_name=_('Fabric and invoke configuration'),
         help_text=_('A yaml formatted fabric/invoke configuration.')
         )
+    config_data = JSONField(
+        blank=True, null=True, editable=False,
+        verbose_name=_('Parsed configuration'),
+        help_text=_('The parsed fabric/invoke configuration.')
+        )
+    max_sessions = models.PositiveIntegerField(
+        blank=True, null=True,
+        verbose_name=_('Max. sessions'),
+        help_text=_('Maximum number of sessions processed concurrently '
+                    'on the hosts of this group.'))
 
     class Meta:
         ordering = ['name']
@@ -464,25 +663,133 @@ class HostGroup(models.Model):
     def __str__(self):
         return self.name
 
+    def get_config(self):
+        """
+        Return the parsed configuration. Fall back to parse the yaml formatted
+        configuration if it was not parsed on save yet. Mind that updating the
+        configuration with :meth:`~django.db.models.query.QuerySet.update`
+        bypasses the parsing.
+        """
+        if self.config_data is None:
+            return load_yaml_configuration(self.config) or dict()
+        return self.config_data
+
     def save(self, *args, **kwargs):
         self.full_clean()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'config' in update_fields:
+            self.config_data = load_yaml_configuration(self.config)
+            if update_fields is not None:
+                kwargs['update_fields'] = list(update_fields) + ['config_data']
         return super().save(*args, **kwargs)
 
 
 class HostQuerySet(models.QuerySet):
     """
-    Besides the get_lock-method this is an imitation of the minkemodel-queryset-api.
+    Besides the lock-methods this is an imitation of the minkemodel-queryset-api.
     """
-    def get_lock(self):
+    LOCK_SCOPES = ('none', 'session', 'host', 'exclusive')
+
+    @transaction.atomic
+    def get_lock(self, scope='exclusive', key=None):
         """
         Set a lock on all selected hosts.
+
+        Depending on the scope a host is locked as follows:
+
+        * 'none': The host won't be locked at all.
+        * 'session': The host is locked for the given key - which is the
+          session-name. Sessions of other classes could run on the host
+          meanwhile.
+        * 'host': The host is locked for other sessions with host-scope.
+          Sessions with session-scope could run on the host meanwhile.
+        * 'exclusive': The host is locked for any session with a lock. This is
+          done by setting :attr:`.Host.lock`.
+
+        Exclusive locks are only granted for hosts without any lock. Locks of
+        other scopes are held by :class:`.HostLock`-objects and only granted
+        for hosts without exclusive lock.
+
+        Locks are leased for MINKE_LOCK_TIMEOUT seconds and have to be renewed
+        by :meth:`.renew_lock` as long as they are in use. Expired locks are
+        reaped beforehand (s. :meth:`.reap_locks`).
+
+        Returns the lock that identifies the locked hosts or None for scope
+        'none'.
         """
-        # The most atomic way to get a lock is a update-query.
-        # We use a timestamp to be able to identify the updated objects.
+        if scope not in self.LOCK_SCOPES:
+            msg = 'lock-scope must be one of {}'.format(self.LOCK_SCOPES)
+            raise InvalidMinkeSetup(msg)
+        elif scope == 'none':
+            return None
+
+        self.reap_locks()
         timestamp = repr(time())
-        self.filter(lock=None).update(lock=timestamp)
+        expires = self.get_lock_expiry()
+
+        # Selecting the hosts for update serializes concurrent lock-requests.
+        host_ids = list(self.select_for_update().filter(lock=None).values_list('id', flat=True))
+        if scope == 'exclusive':
+            hosts = Host.objects.filter(id__in=host_ids, locks=None)
+            hosts.update(lock=timestamp, lock_expires=expires)
+        else:
+            key = key if scope == 'session' else ''
+            locks = [HostLock(host_id=i, key=key, lock=timestamp, expires=expires) for i in host_ids]
+            HostLock.objects.bulk_create(locks, ignore_conflicts=True)
         return timestamp
 
+    def get_locked(self, lock):
+        """
+        Return the ids of all hosts that are locked by the given lock.
+        """
+        host_ids = set(self.filter(lock=lock).values_list('id', flat=True))
+        locks = HostLock.objects.filter(host__in=self, lock=lock)
+        return host_ids | set(locks.values_list('host_id', flat=True))
+
+    def get_lock_expiry(self):
+        """
+        Return the expiry-time for a lock leased now.
+        """
+        return datetime.datetime.now() + datetime.timedelta(seconds=settings.MINKE_LOCK_TIMEOUT)
+
+    def renew_lock(self, lock):
+        """
+        Renew the lease of a lock. Return the number of hosts the lock was
+        renewed for. If the lock was lost no host will be updated.
+        """
+        expires = self.get_lock_expiry()
+        count = self.filter(lock=lock).update(lock_expires=expires)
+        count += HostLock.objects.filter(host__in=self, lock=lock).update(expires=expires)
+        return count
+
+    def release_lock(self, lock):
+        """
+        Release a lock on all selected hosts.
+        """
+        self.filter(lock=lock).update(lock=None, lock_expires=None)
+        HostLock.objects.filter(host__in=self, lock=lock).delete()
+
+    def reap_locks(self):
+        """
+        Release all expired locks. Locks without expiry-time never expire.
+        Return the number of released locks.
+
+        Locks of sessions that are still waiting to be processed are kept for
+        another MINKE_LOCK_QUEUE_TIMEOUT seconds after they expired, since
+        their tasks could be queued for a while. Waiting tasks renew their
+        locks when they are retried or their rollout-batch is due. Sessions
+        whose lock was reaped are canceled as soon as their task is run.
+        """
+        now = datetime.datetime.now()
+        grace = now - datetime.timedelta(seconds=settings.MINKE_LOCK_QUEUE_TIMEOUT)
+        waiting = MinkeSession.objects.filter(proc_status='initialized', lock__isnull=False)
+        waiting = waiting.values('lock')
+        expired = Q(lock_expires__lt=grace) | Q(lock_expires__lt=now) & ~Q(lock__in=waiting)
+        count = self.filter(expired).update(lock=None, lock_expires=None)
+        expired = Q(expires__lt=grace) | Q(expires__lt=now) & ~Q(lock__in=waiting)
+        count += HostLock.objects.filter(expired, host__in=self).delete()[0]
+        return count
+
     def get_hosts(self):
         """
         Return itself (minkemodel-api).
@@ -501,6 +808,12 @@ class HostQuerySet(models.QuerySet):
         """
         return self
 
+    def resolve_hosts(self):
+        """
+        Return a list of all hosts (minkemodel-api).
+        """
+        return list(self)
+
 
 class Host(models.Model):
     """
@@ -551,6 +864,11 @@ class Host(models.Model):
         verbose_name=_('Fabric and invoke configuration'),
         help_text=_('A yaml formatted fabric/invoke configuration.')
         )
+    config_data = JSONField(
+        blank=True, null=True, editable=False,
+        verbose_name=_('Parsed configuration'),
+        help_text=_('The parsed fabric/invoke configuration.')
+        )
     disabled = models.BooleanField(
         default=False,
         verbose_name=_('Disabled'),
@@ -561,6 +879,12 @@ class Host(models.Model):
         help_text=_('Locked hosts won\'t be accessed by minke.'
                     'To prevent intersection a host will be locked '
                     'while sessions are executed on it.'))
+    lock_expires = models.DateTimeField(
+        blank=True, null=True,
+        verbose_name=_('Lock expires'),
+        help_text=_('Locks are leased and renewed while sessions are running. '
+                    'Expired locks are released. Locks without expiry-time '
+                    'never expire.'))
 
     objects = HostQuerySet.as_manager()
     sessions = GenericRelation(MinkeSession,
@@ -573,12 +897,21 @@ class Host(models.Model):
         """
         return self
 
-    def release_lock(self):
+    def release_lock(self, lock=None):
         """
-        Release the host's lock.
+        Release the host's lock. If a lock is given only this lock is
+        released - as long as it is still held. Otherwise all locks are
+        released.
         """
-        self.lock = None
-        self.save(update_fields=['lock'])
+        hosts = Host.objects.filter(pk=self.pk)
+        if lock is None:
+            hosts.update(lock=None, lock_expires=None)
+            self.locks.all().delete()
+        else:
+            hosts.release_lock(lock)
+        if lock is None or self.lock == lock:
+            self.lock = None
+            self.lock_expires = None
 
     class Meta:
         ordering = ['name']
@@ -588,11 +921,193 @@ class Host(models.Model):
     def __str__(self):
         return self.name
 
+    def get_config(self):
+        """
+        Return the parsed configuration. Fall back to parse the yaml formatted
+        configuration if it was not parsed on save yet. Mind that updating the
+        configuration with :meth:`~django.db.models.query.QuerySet.update`
+        bypasses the parsing.
+        """
+        if self.config_data is None:
+            return load_yaml_configuration(self.config) or dict()
+        return self.config_data
+
     def save(self, *args, **kwargs):
         self.full_clean()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'config' in update_fields:
+            self.config_data = load_yaml_configuration(self.config)
+            if update_fields is not None:
+                kwargs['update_fields'] = list(update_fields) + ['config_data']
         return super().save(*args, **kwargs)
 
 
+class HostLock(models.Model):
+    """
+    A non-exclusive lock on a host. See :meth:`.HostQuerySet.get_lock`.
+    """
+    host = models.ForeignKey(Host,
+        on_delete=models.CASCADE,
+        related_name='locks',
+        verbose_name=_('Host'),
+        help_text=_('The locked host.'))
+    key = models.CharField(
+        max_length=128, blank=True,
+        verbose_name=_('Key'),
+        help_text=_('The session-name for locks with session-scope. '
+                    'Empty for locks with host-scope.'))
+    lock = models.CharField(
+        max_length=20,
+        verbose_name=_('Lock'),
+        help_text=_('Identifies the process holding the lock.'))
+    expires = models.DateTimeField(
+        verbose_name=_('Expires'),
+        help_text=_('Locks are leased and renewed while sessions are running.'))
+
+    class Meta:
+        unique_together = ('host', 'key')
+        verbose_name = _('Host-Lock')
+        verbose_name_plural = _('Host-Locks')
+
+
+class SessionSlotQuerySet(models.QuerySet):
+    """
+    A database-backed semaphore to limit the number of concurrently processed
+    sessions.
+    """
+    def acquire(self, limits):
+        """
+        Acquire a slot for each key of the limits-dictonary which maps keys to
+        the maximum number of slots. Either all slots or none are acquired.
+
+        Returns a token identifying the acquired slots or None if at least one
+        of the limits is reached. Slots are leased like locks and must be
+        renewed by :meth:`.renew` as long as they are in use.
+        """
+        self.reap()
+        holder = uuid.uuid4().hex
+        expires = Host.objects.get_lock_expiry()
+        try:
+            with transaction.atomic():
+                for key, limit in limits.items():
+                    if not self.acquire_one(key, limit, holder, expires):
+                        raise IntegrityError
+        except IntegrityError:
+            return None
+        return holder
+
+    def acquire_one(self, key, limit, holder, expires):
+        """
+        Acquire a single slot. Return True on success.
+        """
+        used = set(self.filter(key=key).values_list('number', flat=True))
+        for number in (n for n in range(limit) if n not in used):
+            # The unique-constraint prevents two holders to get the same slot.
+            try:
+                with transaction.atomic():
+                    self.create(key=key, number=number, holder=holder, expires=expires)
+            except IntegrityError:
+                continue
+            else:
+                return True
+        return False
+
+    def renew(self, holder):
+        """
+        Renew the lease of all slots of a holder.
+        """
+        return self.filter(holder=holder).update(expires=Host.objects.get_lock_expiry())
+
+    def release(self, holder):
+        """
+        Release all slots of a holder.
+        """
+        return self.filter(holder=holder).delete()[0]
+
+    def reap(self):
+        """
+        Release all expired slots.
+        """
+        return self.filter(expires__lt=datetime.datetime.now()).delete()[0]
+
+
+class SessionSlot(models.Model):
+    """
+    A slot of a concurrency-limit. See :class:`.SessionSlotQuerySet`.
+    """
+    objects = SessionSlotQuerySet.as_manager()
+
+    key = models.CharField(
+        max_length=255,
+        verbose_name=_('Key'),
+        help_text=_('Identifies the concurrency-limit.'))
+    number = models.PositiveIntegerField(
+        verbose_name=_('Number'),
+        help_text=_('Number of the slot.'))
+    holder = models.CharField(
+        max_length=32,
+        verbose_name=_('Holder'),
+        help_text=_('Identifies the process holding the slot.'))
+    expires = models.DateTimeField(
+        verbose_name=_('Expires'),
+        help_text=_('Slots are leased and renewed while sessions are running.'))
+
+    class Meta:
+        unique_together = ('key', 'number')
+        verbose_name = _('Session-Slot')
+        verbose_name_plural = _('Session-Slots')
+
+
+class RegistryGeneration(models.Model):
+    """
+    The generation of the session-registry shared by all processes. There is
+    only a single row. See :class:`.sessions.RegistryDict`.
+    """
+    generation = models.CharField(
+        max_length=32,
+        verbose_name=_('Generation'),
+        help_text=_('Changes whenever dynamic sessions have to be reloaded.'))
+
+    class Meta:
+        verbose_name = _('Registry-Generation')
+        verbose_name_plural = _('Registry-Generations')
+
+
+class Dispatch(models.Model):
+    """
+    The progress of sessions dispatched in the background. See
+    :func:`.engine.dispatch`.
+    """
+    id = models.CharField(
+        max_length=32, primary_key=True,
+        verbose_name=_('Dispatch-ID'))
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE,
+        verbose_name=_("User"),
+        help_text=_('User that dispatched the sessions.'))
+    total = models.PositiveIntegerField(
+        blank=True, null=True,
+        verbose_name=_('Total'),
+        help_text=_('Number of objects to run sessions on.'))
+    dispatched = models.PositiveIntegerField(
+        default=0,
+        verbose_name=_('Dispatched'),
+        help_text=_('Number of objects sessions were dispatched for.'))
+    done = models.BooleanField(
+        default=False,
+        verbose_name=_('Done'))
+    failed = models.BooleanField(
+        default=False,
+        verbose_name=_('Failed'))
+    created_time = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name=_("Created-time"))
+
+    class Meta:
+        verbose_name = _('Dispatch')
+        verbose_name_plural = _('Dispatches')
+
+
 class MinkeQuerySet(models.QuerySet):
     """
     A queryset-api to work with related hosts.
@@ -630,6 +1145,42 @@ class MinkeQuerySet(models.QuerySet):
             msg = "Invalid host-lookup: {}".format(self.model.HOST_LOOKUP)
             raise InvalidMinkeSetup(msg)
 
+    def get_host_map(self):
+        """
+        Map the primary-keys of all objects to their hosts.
+        The hosts are fetched by a single query.
+        """
+        lookup = self.model.get_reverse_host_lookup()
+        try:
+            hosts = Host.objects.filter(**{lookup + '__in': self.values('pk')})
+            hosts = hosts.annotate(minkeobj_pk=F(lookup))
+            host_map = dict()
+            for host in hosts:
+                if host.minkeobj_pk in host_map:
+                    msg = f"Multiple hosts found by reverse lookup parameter: {lookup}"
+                    raise InvalidMinkeSetup(msg)
+                host_map[host.minkeobj_pk] = host
+            return host_map
+        except FieldError:
+            msg = f"Invalid reverse lookup: {lookup}"
+            raise InvalidMinkeSetup(msg)
+
+    def resolve_hosts(self):
+        """
+        Return a list of all objects with their hosts already resolved.
+        This takes two queries - one for the objects and one for the hosts.
+        """
+        host_map = self.get_host_map()
+        minkeobjs = list(self)
+        for minkeobj in minkeobjs:
+            try:
+                minkeobj._host = host_map[minkeobj.pk]
+            except KeyError:
+                lookup = self.model.get_reverse_host_lookup()
+                msg = f"No host found by reverse lookup parameter:{lookup}"
+                raise InvalidMinkeSetup(msg)
+        return minkeobjs
+
 
 class MinkeModel(models.Model):
     """
@@ -662,11 +1213,15 @@ class MinkeModel(models.Model):
 
     def get_host(self):
         """
-        Return the related host-instance.
+        Return the related host-instance. The host is cached on the instance.
         """
+        if getattr(self, '_host', None) is not None:
+            return self._host
+
         reverse_lookup = self.get_reverse_host_lookup()
         try:
-            return Host.objects.get(**{reverse_lookup + '__in': [self]})
+            self._host = Host.objects.get(**{reverse_lookup + '__in': [self]})
+            return self._host
         except Host.DoesNotExist:
             msg = f"No host found by reverse lookup parameter:{reverse_lookup}"
             raise InvalidMinkeSetup(msg)
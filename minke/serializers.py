@@ -9,7 +9,7 @@ from .models import BaseMessage
 class MessageSerializer(serializers.ModelSerializer):
     class Meta:
         model = BaseMessage
-        fields = ('level', 'html')
+        fields = ('id', 'level', 'html')
 
 
 class SessionSerializer(serializers.ModelSerializer):
@@ -20,3 +20,7 @@ class SessionSerializer(serializers.ModelSerializer):
         fields = ('id', 'minkeobj_id', 'session_status', \
                   'proc_status', 'proc_info', 'messages', 'is_done')
         read_only_fields = fields
+
+
+class SessionUpdateSerializer(SessionSerializer):
+    messages = MessageSerializer(source='new_messages', many=True, read_only=True)
@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 
+import uuid
 import logging
 import functools
+from threading import RLock
 from collections import OrderedDict
 from fabric2.runners import Result
 
@@ -14,6 +16,7 @@ from .models import Host
 from .models import MinkeModel
 from .models import MinkeSession
 from .models import BaseMessage
+from .models import RegistryGeneration
 from .forms import CommandForm
 from .messages import PreMessage
 from .messages import TableMessage
@@ -29,34 +32,94 @@ logger = logging.getLogger(__name__)
 class RegistryDict(OrderedDict):
     """
     A reload-able session-registry.
+
+    Dynamic sessions are only reloaded if the registry's generation changed
+    since the last reload. The generation is shared between processes by the
+    database (s. :class:`.models.RegistryGeneration`). Call :meth:`.changed`
+    whenever the data dynamic sessions are build from was changed.
     """
     reload_sessions = Signal(providing_args=['session_name'])
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._static_sessions = None
+        self._generation = None
+        self._lock = RLock()
+
+    @property
+    def generation(self):
+        """
+        The generation of the loaded sessions.
+        """
+        return self._generation
+
+    def get_generation(self):
+        """
+        Get the current generation. Initialize it if not set yet.
+        """
+        defaults = dict(generation=uuid.uuid4().hex)
+        return RegistryGeneration.objects.get_or_create(pk=1, defaults=defaults)[0].generation
+
+    def changed(self):
+        """
+        Start a new generation. All registries will be reloaded on their next
+        call of :meth:`.reload`.
+        """
+        defaults = dict(generation=uuid.uuid4().hex)
+        RegistryGeneration.objects.update_or_create(pk=1, defaults=defaults)
 
-    def reload(self, session_name=None):
+    def reload(self, session_name=None, force=False):
         """
         Load dynamical sessions into the registry.
 
         Reset the registry to the static sessions. Then send a reload-signal.
+        Receivers of the signal are expected to register all their sessions.
+        Skip the reload if the generation did not change and session_name is
+        already registered.
+        """
+        generation = self.get_generation()
+        if not force and self._generation == generation:
+            if not session_name or session_name in self:
+                return
+
+        # The registry could be shared by multiple threads.
+        with self._lock:
+            # We backup the static-sessions and reset the registry before each
+            # reload. This way the reload algorithms doesn't have to unregister
+            # obsolete sessions.
+            if self._static_sessions:
+                self.clear()
+                self.update(self._static_sessions)
+            else:
+                self._static_sessions = self.copy()
+
+            # trigger the reload signal
+            self.reload_sessions.send(sender=self.__class__, session_name=session_name)
+            self._generation = generation
+
+    def create_permissions(self):
+        """
+        Create the missing run-permissions of all registered sessions using
+        auto_permission. Return the created permissions.
+
+        Reloading the registry does not touch any permission. So call this
+        whenever sessions were added - e.g. by the minkeadm-command.
         """
-        # We backup the static-sessions and reset the registry before each
-        # reload. This way the reload algorithms doesn't have to unregister
-        # obsolete sessions.
-        if self._static_sessions:
-            self.clear()
-            self.update(self._static_sessions)
-        else:
-            self._static_sessions = self.copy()
+        content_type = ContentType.objects.get_for_model(MinkeSession)
+        permissions = dict()
+        for session_cls in self.values():
+            if session_cls.auto_permission:
+                codename, name, _ = session_cls._get_permission()
+                permissions[codename] = Permission(
+                    codename=codename, name=name, content_type=content_type)
 
-        # no reloading needed for static sessions
-        if session_name and session_name in self:
-            return
+        existing = Permission.objects.filter(
+            content_type=content_type, codename__in=permissions.keys())
+        for codename in existing.values_list('codename', flat=True):
+            del permissions[codename]
 
-        # trigger the reload signal
-        self.reload_sessions.send(sender=self.__class__, session_name=session_name)
+        # Permissions could have been created meanwhile by another process.
+        return Permission.objects.bulk_create(list(permissions.values()), ignore_conflicts=True)
 
 
 REGISTRY = RegistryDict()
@@ -298,6 +361,82 @@ class Session(metaclass=SessionRegistration):
     :doc:`invoke <invoke:concepts/configuration>`.
     """
 
+    rollout_canary = 0
+    """
+    Number of hosts processed in a first batch before any other host. Setting
+    this or :attr:`.rollout_batch_size` enables the rollout-mode: Hosts are
+    processed batch by batch. Each batch is processed in parallel. Once a
+    batch is done the sessions of all remaining batches are canceled if more
+    than :attr:`.rollout_max_failures` sessions ended with an error.
+
+    Note
+    ----
+    The batches are chained by celery's chords-primitive, which needs a
+    functioning result-backend to be configured. Please see the
+    :ref:`celery-documentation <chord-important-notes>` for more details.
+    """
+
+    rollout_batch_size = None
+    """
+    Number of hosts per batch in rollout-mode. Pass a float to define the
+    batch-size as fraction of all hosts (e.g. 0.05 for batches of 5%).
+    Rollout-mode needs a result-backend (s. :attr:`.rollout_canary`).
+    """
+
+    rollout_pause = 0
+    """Seconds to wait between two batches in rollout-mode."""
+
+    rollout_max_failures = None
+    """
+    Maximum number of sessions that may end with an error in rollout-mode
+    before the remaining batches are canceled. None means no limit.
+    """
+
+    queue = None
+    """
+    Name of the celery-queue the session's tasks are routed to. By default
+    the task-routing of the celery-app applies. Could be overwritten per run
+    (s. MINKE_ADMIN_QUEUE and the --queue option of the minkerun-command).
+    Use it to keep bulk-jobs apart from interactive runs.
+    """
+
+    priority = None
+    """
+    Priority of the session's tasks. Only supported by some brokers (s.
+    celery-docs). Could be overwritten per run like :attr:`.queue`.
+    """
+
+    max_sessions = None
+    """
+    Maximum number of sessions of this class processed concurrently. See also
+    :attr:`.models.HostGroup.max_sessions` and MINKE_MAX_SESSIONS.
+    """
+
+    lock_scope = 'exclusive'
+    """
+    Defines how hosts are locked while the session is processed. Must be one
+    of 'none', 'session', 'host' or 'exclusive'. By default a host is locked
+    exclusively: No other session with a lock could be run on it meanwhile.
+    Sessions that only read from a host (e.g. to collect some inventory-data)
+    could use a weaker scope to be run in parallel with other sessions. See
+    :meth:`.models.HostQuerySet.get_lock` for details.
+    """
+
+    fanout = None
+    """
+    Number of hosts processed concurrently by a single celery-task. By default
+    each host occupies a celery-task of its own. Since sessions spend most of
+    their time waiting for remote-processes, a single worker could handle lots
+    of hosts in threads. Use it for mostly idle sessions on many hosts. Up to
+    MINKE_FANOUT_THREADS hosts are processed at once, each thread using a
+    database-connection of its own.
+
+    Note
+    ----
+    In fanout-mode sessions could only be stopped softly: A running command
+    won't be interrupted. The session is stopped once the command returned.
+    """
+
     parrallel_per_host = False
     """
     Allow parrallel processing of multiple celery-tasks on a single host.
@@ -335,6 +474,7 @@ class Session(metaclass=SessionRegistration):
         self._busy = False
         self.start = db.start
         self.end = db.end
+        self.flush = db.flush
 
     @classmethod
     def get_form(cls):
@@ -440,7 +580,7 @@ class Session(metaclass=SessionRegistration):
             msg = ExecutionMessage(msg, level)
         elif isinstance(msg, BaseMessage):
             pass
-        self._db.messages.add(msg, bulk=False)
+        self._db.buffer(msg)
 
     def set_status(self, status, update=True):
         """
@@ -498,7 +638,9 @@ class Session(metaclass=SessionRegistration):
         and invoke-parameters.
 
         Additionally save the :class:`~invoke.runners.Result`-object as an
-        :class:`.models.CommandResult`-object.
+        :class:`.models.CommandResult`-object. Messages and command-results
+        are saved in bulk. Pending ones are flushed before a command is run.
+        So they won't be held back while a long running command is processed.
 
         Parameters
         ----------
@@ -512,8 +654,9 @@ class Session(metaclass=SessionRegistration):
         -------
         object of :class:`.models.CommandResult`
         """
+        self.flush()
         result = self.c.run(cmd, **invoke_params)
-        self._db.commands.add(result, bulk=False)
+        self._db.buffer(result)
         return result
 
     @protect
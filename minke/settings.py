@@ -1,11 +1,28 @@
 # -*- coding: utf-8 -*-
 
 from django.conf import settings
-from .fabrictools import FabricConfig
-from .fabrictools import FabricRemote
 
 
 MINKE_DEBUG = getattr(settings, 'MINKE_DEBUG', False)
 MINKE_FABRIC_FORM = getattr(settings, 'MINKE_FABRIC_FORM', None)
 MINKE_CLI_USER = getattr(settings, 'MINKE_CLI_USER', 'admin')
 MINKE_MESSAGE_WRAP = getattr(settings, 'MINKE_MESSAGE_WRAP', 120)
+MINKE_RESULT_INTERVAL = getattr(settings, 'MINKE_RESULT_INTERVAL', 0.5)
+MINKE_BULK_SIZE = getattr(settings, 'MINKE_BULK_SIZE', 500)
+MINKE_CONNECTION_IDLE_TIMEOUT = getattr(settings, 'MINKE_CONNECTION_IDLE_TIMEOUT', 60)
+MINKE_FANOUT_THREADS = getattr(settings, 'MINKE_FANOUT_THREADS', 32)
+MINKE_CONFIG_CACHE_SIZE = getattr(settings, 'MINKE_CONFIG_CACHE_SIZE', 128)
+MINKE_STREAM_INTERVAL = getattr(settings, 'MINKE_STREAM_INTERVAL', 0.4)
+MINKE_STREAM_TIMEOUT = getattr(settings, 'MINKE_STREAM_TIMEOUT', 300)
+MINKE_BUFFER_SIZE = getattr(settings, 'MINKE_BUFFER_SIZE', 100)
+MINKE_BUFFER_INTERVAL = getattr(settings, 'MINKE_BUFFER_INTERVAL', 1)
+MINKE_COMPRESSION = getattr(settings, 'MINKE_COMPRESSION', False)
+MINKE_LOCK_TIMEOUT = getattr(settings, 'MINKE_LOCK_TIMEOUT', 120)
+MINKE_LOCK_QUEUE_TIMEOUT = getattr(settings, 'MINKE_LOCK_QUEUE_TIMEOUT', 3600)
+MINKE_MAX_SESSIONS = getattr(settings, 'MINKE_MAX_SESSIONS', None)
+MINKE_CONCURRENCY_RETRY_INTERVAL = getattr(settings, 'MINKE_CONCURRENCY_RETRY_INTERVAL', 5)
+MINKE_CONCURRENCY_RETRY_MAX_INTERVAL = getattr(settings, 'MINKE_CONCURRENCY_RETRY_MAX_INTERVAL', 60)
+MINKE_ADMIN_QUEUE = getattr(settings, 'MINKE_ADMIN_QUEUE', None)
+MINKE_ADMIN_PRIORITY = getattr(settings, 'MINKE_ADMIN_PRIORITY', None)
+MINKE_SESSION_OPTIONS_CACHE_SIZE = getattr(settings, 'MINKE_SESSION_OPTIONS_CACHE_SIZE', 256)
+MINKE_DISPATCH_CHUNK_SIZE = getattr(settings, 'MINKE_DISPATCH_CHUNK_SIZE', 500)
@@ -2,11 +2,25 @@
 
 var sessions = {};
 var interval = 400;
+var reconnect_delay = interval;
+var max_reconnect_delay = 30000;
+var stream_failures = 0;
+var max_stream_failures = 3;
+var summary_timer = null;
 var error_msg = 'minkeapi-error: ';
 var summary_url = null;
 var baseurl = window.location.protocol + '//'
             + window.location.host
             + '/minkeapi/sessions/?id__in=';
+var updates_url = window.location.protocol + '//'
+                + window.location.host
+                + '/minkeapi/sessions/updates/';
+var stream_url = window.location.protocol + '//'
+               + window.location.host
+               + '/minkeapi/sessions/stream/';
+var dispatch_url = window.location.protocol + '//'
+                 + window.location.host
+                 + '/minkeapi/dispatch/';
 
 class Session {
     constructor(session_el) {
@@ -14,11 +28,17 @@ class Session {
         this.session = $(session_el);
         this.minkeobj = $(session_el).prev('tr');
     }
+    state() {
+        return {
+            proc_status: this.session.attr('data-proc-status'),
+            msg_id: this.session.attr('data-msg-id')
+        }
+    }
     update(session) {
         if (session.proc_status != this.session.attr('data-proc-status')) {
             this.updateProcStatus(session);
         }
-        if (session.messages.length > this.session.attr('data-msg-count')) {
+        if (session.messages.length) {
             this.updateMessages(session);
         }
         if (session.is_done) {
@@ -36,10 +56,15 @@ class Session {
         this.session.addClass(session.proc_status);
     }
     updateMessages(session) {
+        // skip messages we already know of - e.g. after a reconnected stream
+        var msg_id = parseInt(this.session.attr('data-msg-id'));
+        var messages = session.messages.filter(function(msg) {return msg.id > msg_id});
+        if (!messages.length) return;
         var that = this;
-        session.messages.slice(this.session.attr('data-msg-count'))
-            .forEach(function(msg) {that.addMessage(msg)});
-        this.session.attr('data-msg-count', session.messages.length);
+        var count = parseInt(this.session.attr('data-msg-count'));
+        messages.forEach(function(msg) {that.addMessage(msg)});
+        this.session.attr('data-msg-count', count + messages.length);
+        this.session.attr('data-msg-id', messages.slice(-1)[0].id);
     }
     addMessage(msg) {
         var li = $('<li>' + msg.html + '</li>').addClass(msg.level).hide();
@@ -57,8 +82,75 @@ function updateSummary() {
     $.getJSON(summary_url, updateSum).fail(ajaxFail)
 }
 
-function getJson (url) {
-    $.getJSON(url, processJson).fail(ajaxFail).done(updateSummary).done(run)
+function getUpdates() {
+    var states = {};
+    $.each(sessions, function(id, session) {states[id] = session.state()});
+    $.ajax({
+        url: updates_url,
+        method: 'POST',
+        data: JSON.stringify(states),
+        contentType: 'application/json',
+        dataType: 'json'
+    }).done(processJson).fail(ajaxFail).done(updateSummary).done(run)
+}
+
+function scheduleSummary() {
+    // update the summary at most once per interval
+    if (summary_timer) return;
+    summary_timer = window.setTimeout(function() {
+        summary_timer = null;
+        updateSummary();
+    }, interval);
+}
+
+function subscribe() {
+    var ids = $.map(sessions, function(session, i) {return session.id});
+    var msg_ids = $.map(sessions, function(session, i) {return session.state().msg_id});
+    var url = stream_url + '?id__in=' + ids + '&msg_id=' + Math.min.apply(null, msg_ids);
+    var source = new EventSource(url);
+    var opened = false;
+    source.onopen = function() {
+        opened = true;
+        stream_failures = 0;
+        reconnect_delay = interval;
+    };
+    source.addEventListener('session', function(event) {
+        var session = JSON.parse(event.data);
+        if (session.id in sessions) sessions[session.id].update(session);
+        scheduleSummary();
+    });
+    source.addEventListener('done', function(event) {
+        source.close();
+        run();
+    });
+    source.onerror = function() {
+        // The server closed the stream or we could not connect at all. An
+        // expired stream is reconnected with the current session-states.
+        // If streaming is not available we fall back to polling.
+        source.close();
+        if (!opened) stream_failures++;
+        if ($.isEmptyObject(sessions) || stream_failures >= max_stream_failures) {
+            run();
+        } else {
+            window.setTimeout(subscribe, reconnect_delay);
+            reconnect_delay = Math.min(reconnect_delay * 2, max_reconnect_delay);
+        }
+    };
+}
+
+function watchDispatch() {
+    // sessions are dispatched in the background - show the progress and
+    // reload the changelist once all sessions were initialized
+    var dispatch = $('p.minke-dispatch');
+    $.getJSON(dispatch_url + dispatch.data('id') + '/', function(progress) {
+        var total = progress.total === null ? '?' : progress.total;
+        dispatch.find('span').text(progress.dispatched + '/' + total);
+        if (progress.done) {
+            window.location.reload();
+        } else {
+            window.setTimeout(watchDispatch, interval);
+        }
+    }).fail(ajaxFail);
 }
 
 function processJson(json) {
@@ -108,13 +200,9 @@ function toggleMessageList() {
 }
 
 function run() {
-    // get session-ids
-    var session_ids = $.map(sessions, function(session, i) {return session.id});
-
     // if we have sessions left... process
-    if (session_ids.length) {
-        var url = baseurl + session_ids;
-        window.setTimeout(getJson, interval, url);
+    if (!$.isEmptyObject(sessions)) {
+        window.setTimeout(getUpdates, interval);
     } else {
         $('#action-toggle').prop('disabled', false);
         $('#result_list').removeClass('running', 'stopping');
@@ -123,6 +211,9 @@ function run() {
 
 $(document).ready(function () {
 
+    // watch sessions dispatched in the background
+    if ($('p.minke-dispatch').length) watchDispatch();
+
     // initiate message-toggles
     $('div.session_select a.message-toggle').click(toggleAllMessageLists);
     $('tr.session a.message-toggle').click(toggleMessageList);
@@ -157,8 +248,12 @@ $(document).ready(function () {
         // build the summary-url
         summary_url = baseurl + session_ids + '&summary=1';
 
-        // start processing
-        run();
+        // start processing - use server-sent events if possible
+        if (window.EventSource) {
+            subscribe();
+        } else {
+            run();
+        }
     }
 });
 
@@ -1,7 +1,14 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import random
 import signal
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from threading import Thread
+from threading import Event
+from threading import current_thread
+from threading import main_thread
 
 from socket import error as SocketError
 from socket import gaierror as GaiError
@@ -12,35 +19,218 @@ from invoke.exceptions import ThreadException
 from invoke.exceptions import UnexpectedExit
 from celery import shared_task
 
+from django.db import connection
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+
 from . import settings
 from .models import Host
 from .models import MinkeSession
+from .models import SessionSlot
 from .exceptions import SessionError
+from .exceptions import ConcurrencyLimitReached
 from .sessions import REGISTRY
+from .messages import Message
 from .messages import ExceptionMessage
-from .fabrictools import FabricConfig
+from .fabrictools import ConfigCache
+from .fabrictools import ConnectionPool
+from .utils import get_changelist_queryset
 
 
 logger = logging.getLogger(__name__)
+CONNECTIONS = ConnectionPool(settings.MINKE_CONNECTION_IDLE_TIMEOUT)
+CONFIGS = ConfigCache(settings.MINKE_CONFIG_CACHE_SIZE)
+
+
+class LockHeartbeat(Thread):
+    """
+    Renew the leases of host-locks and session-slots in the background.
+
+    The leases are renewed three times per MINKE_LOCK_TIMEOUT. So the locks
+    outlive long running commands, but expire soon after the worker died.
+    A single heartbeat serves all hosts of a task - leases are added and
+    removed while the heartbeat is running.
+    """
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.leases = list()
+        self.stopped = Event()
+        self._lock = Lock()
+
+    def add(self, host_id, lock=None, slot=None):
+        with self._lock:
+            self.leases.append((host_id, lock, slot))
+
+    def remove(self, host_id, lock=None, slot=None):
+        with self._lock:
+            self.leases.remove((host_id, lock, slot))
+
+    def renew(self):
+        """
+        Renew all leases. Host-locks are renewed per lock in a single query.
+        """
+        with self._lock:
+            leases = list(self.leases)
+        locks = dict()
+        for host_id, lock, slot in leases:
+            if lock:
+                locks.setdefault(lock, set()).add(host_id)
+            if slot:
+                SessionSlot.objects.renew(slot)
+        for lock, host_ids in locks.items():
+            Host.objects.filter(pk__in=host_ids).renew_lock(lock)
+
+    def run(self):
+        try:
+            while not self.stopped.wait(settings.MINKE_LOCK_TIMEOUT / 3):
+                self.renew()
+        finally:
+            # Each thread has its own database-connection.
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
 
 
 class SessionProcessor:
     """
-    Process sessions.
+    Process one or more sessions on a single host.
+
+    All sessions share one connection per session-class. Sessions are
+    processed one after another in the order of the given session-ids.
+
+    The host's lock is renewed while the sessions are processed. If the lock
+    was lost meanwhile (e.g. the sessions were canceled while the task was
+    queued and another process locked the host) the sessions are canceled.
+
+    Before any session is processed a slot is acquired for each concurrency-
+    limit that applies: MINKE_MAX_SESSIONS, :attr:`.models.HostGroup.max_sessions`
+    of the host's groups and :attr:`.sessions.Session.max_sessions` of the
+    session-classes. If a limit is reached :class:`.ConcurrencyLimitReached`
+    is raised.
     """
-    def __init__(self, host_id, session_id, runtime_data):
-        minke_session = MinkeSession.objects.get(pk=session_id)
-        REGISTRY.reload(minke_session.session_name)
-        session_cls = REGISTRY[minke_session.session_name]
-        host = Host.objects.get(pk=host_id)
-        hostname = host.hostname or host.name
-        config = FabricConfig(host, session_cls, runtime_data)
-        self.con = Connection(hostname, host.username, host.port, config=config)
-        self.session = session_cls(self.con, minke_session)
+    def __init__(self, host_id, session_ids, runtime_data, lock=None, heartbeat=None):
+        self.host = Host.objects.get(pk=host_id)
+        self.lock = lock
+        self.heartbeat = heartbeat
+        self.runtime_data = runtime_data
+        minke_sessions = MinkeSession.objects.in_bulk(session_ids)
+        self.minke_sessions = [minke_sessions[i] for i in session_ids if i in minke_sessions]
+        self.session_classes = dict()
+        self.connections = dict()
+        self.session = None
+
+    def get_connection(self, session_cls):
+        """
+        Get a connection for a session-class. Each connection is only build
+        once and reuses a pooled ssh-client if possible.
+        """
+        if session_cls not in self.connections:
+            hostname = self.host.hostname or self.host.name
+            config = CONFIGS.get(self.host, session_cls, self.runtime_data)
+            con = Connection(hostname, self.host.username, self.host.port, config=config)
+            self.connections[session_cls] = CONNECTIONS.connect(con)
+        return self.connections[session_cls]
+
+    def get_session_cls(self, session_name):
+        """
+        Get the session-class for a session-name.
+        """
+        # We only need to reload the registry once per session-name.
+        if not session_name in self.session_classes:
+            REGISTRY.reload(session_name)
+            self.session_classes[session_name] = REGISTRY[session_name]
+        return self.session_classes[session_name]
+
+    def get_session(self, minke_session):
+        """
+        Initialize the session for a minke-session.
+        """
+        session_cls = self.get_session_cls(minke_session.session_name)
+        return session_cls(self.get_connection(session_cls), minke_session)
+
+    def get_limits(self):
+        """
+        Collect the concurrency-limits that apply to the sessions.
+        """
+        limits = dict()
+        if settings.MINKE_MAX_SESSIONS:
+            limits['global'] = settings.MINKE_MAX_SESSIONS
+        for group in self.host.groups.all():
+            if group.max_sessions:
+                limits[f'hostgroup:{group.id}'] = group.max_sessions
+        for minke_session in self.minke_sessions:
+            session_cls = self.get_session_cls(minke_session.session_name)
+            if session_cls.max_sessions:
+                limits[f'session:{session_cls.__name__}'] = session_cls.max_sessions
+        return limits
+
+    def cancel(self, msg):
+        """
+        Cancel all sessions with an error-message.
+        """
+        for minke_session in self.minke_sessions:
+            minke_session.cancel()
+            minke_session.buffer(Message(msg, 'error'))
+            minke_session.flush()
 
     def run(self):
         """
-        Run the task.
+        Run all sessions.
+        """
+        # sessions could have been canceled while we were waiting
+        if not any(s.is_waiting for s in self.minke_sessions):
+            return
+
+        if self.lock and not Host.objects.filter(pk=self.host.pk).renew_lock(self.lock):
+            self.cancel(f'{self.host}: Host-lock expired.')
+            return
+
+        limits = self.get_limits()
+        slot = SessionSlot.objects.acquire(limits) if limits else None
+        if limits and not slot:
+            raise ConcurrencyLimitReached(limits)
+
+        # Use the heartbeat of the FanoutProcessor or start one of our own.
+        lease = (self.host.pk, self.lock, slot)
+        heartbeat = self.heartbeat
+        if not heartbeat and (self.lock or slot):
+            heartbeat = LockHeartbeat()
+            heartbeat.start()
+        if heartbeat:
+            heartbeat.add(*lease)
+
+        try:
+            for minke_session in self.minke_sessions:
+                self.session = self.get_session(minke_session)
+                # Signal-handlers could only be set in the main-thread. In
+                # fanout-mode the FanoutProcessor takes care of the signals.
+                if current_thread() is main_thread():
+                    signal.signal(signal.SIGUSR1, self.session.stop)
+                self.process()
+
+        # at least give the ssh-connections back to the pool
+        finally:
+            if heartbeat:
+                heartbeat.remove(*lease)
+            if heartbeat and not self.heartbeat:
+                heartbeat.stop()
+            if slot:
+                SessionSlot.objects.release(slot)
+            for con in self.connections.values():
+                CONNECTIONS.release(con)
+
+    def stop(self):
+        """
+        Stop the current session softly. This could be called from any thread.
+        """
+        if self.session:
+            self.session._stopped = True
+
+    def process(self):
+        """
+        Process the current session.
         """
         try:
             started = self.session.start()
@@ -88,23 +278,213 @@ class SessionProcessor:
         except KeyboardInterrupt:
             self.session.end()
 
-        # at least close the ssh-connection
+        # Messages could be added after the session has ended.
+        finally:
+            self.session.flush()
+
+
+class FanoutProcessor:
+    """
+    Process the sessions of multiple hosts concurrently in threads.
+
+    Each item of host_sessions is a pair of a host-id and a list of
+    session-ids, which are processed by a :class:`.SessionProcessor` within
+    a thread of its own. Since the stop-signal is received by the main-thread
+    sessions that are about to be stopped are stopped softly.
+
+    At most MINKE_FANOUT_THREADS hosts are processed at once and all leases
+    are renewed by a single :class:`.LockHeartbeat`. Each thread holds a
+    database-connection of its own.
+    """
+    def __init__(self, host_sessions, runtime_data, lock=None):
+        self.host_sessions = host_sessions
+        self.runtime_data = runtime_data
+        self.lock = lock
+        self.heartbeat = LockHeartbeat()
+        self.processors = list()
+        self.waiting = list()
+
+    def stop(self, *args, **kwargs):
+        """
+        Stop all sessions that are about to be stopped.
+        """
+        session_ids = [p.session._db.id for p in self.processors if p.session]
+        stopping = MinkeSession.objects.filter(id__in=session_ids, proc_status='stopping')
+        stopping = set(stopping.values_list('id', flat=True))
+        for processor in self.processors:
+            if processor.session and processor.session._db.id in stopping:
+                processor.stop()
+
+    def process(self, host_id, session_ids):
+        try:
+            processor = SessionProcessor(
+                host_id, session_ids, self.runtime_data, self.lock, self.heartbeat)
+            self.processors.append(processor)
+            processor.run()
+        except ConcurrencyLimitReached:
+            self.waiting.append((host_id, session_ids))
+        except Exception:
+            logger.error(ExceptionMessage(print_tb=True).text)
         finally:
-            self.con.close()
+            # Each thread has its own database-connection.
+            connection.close()
+
+    def run(self):
+        """
+        Run all sessions. Return the items that wait for a concurrency-slot.
+        """
+        signal.signal(signal.SIGUSR1, self.stop)
+        # Load the registry before the threads look up their sessions.
+        REGISTRY.reload()
+        max_workers = min(len(self.host_sessions), settings.MINKE_FANOUT_THREADS)
+        self.heartbeat.start()
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for host_id, session_ids in self.host_sessions:
+                    executor.submit(self.process, host_id, session_ids)
+        finally:
+            self.heartbeat.stop()
+        return self.waiting
+
 
+def get_retry_countdown(retries):
+    """
+    Get the countdown for the next retry of a task waiting for a concurrency-
+    slot. Starting with MINKE_CONCURRENCY_RETRY_INTERVAL the interval doubles
+    with each retry up to MINKE_CONCURRENCY_RETRY_MAX_INTERVAL. The countdown
+    is spread randomly within the upper half of the interval, so waiting tasks
+    won't retry in lockstep.
+    """
+    interval = settings.MINKE_CONCURRENCY_RETRY_INTERVAL * 2 ** min(retries, 16)
+    interval = min(interval, settings.MINKE_CONCURRENCY_RETRY_MAX_INTERVAL)
+    return random.uniform(interval / 2, interval)
+
+
+@shared_task(bind=True)
+def process_session(task, host_id, session_id, runtime_data, lock=None):
+    """
+    Task for session-processing. If a concurrency-limit is reached the task
+    is retried with backoff (s. :func:`.get_retry_countdown`).
+    """
+    try:
+        SessionProcessor(host_id, [session_id], runtime_data, lock).run()
+    except ConcurrencyLimitReached:
+        if lock: Host.objects.filter(pk=host_id).renew_lock(lock)
+        countdown = get_retry_countdown(task.request.retries)
+        raise task.retry(countdown=countdown, max_retries=None)
+
+@shared_task(bind=True)
+def process_host(task, host_id, session_ids, runtime_data, lock=None):
+    """
+    Task to process multiple sessions on a single host and release the host's
+    lock afterwards. If a concurrency-limit is reached the task is retried
+    with backoff (s. :func:`.get_retry_countdown`).
+    """
+    waiting = False
+    try:
+        SessionProcessor(host_id, session_ids, runtime_data, lock).run()
+    except ConcurrencyLimitReached:
+        waiting = True
+        if lock: Host.objects.filter(pk=host_id).renew_lock(lock)
+        countdown = get_retry_countdown(task.request.retries)
+        raise task.retry(countdown=countdown, max_retries=None)
+    finally:
+        # Keep the lock as long as we are waiting for a free slot.
+        if lock and not waiting:
+            Host.objects.get(pk=host_id).release_lock(lock)
 
 @shared_task(bind=True)
-def process_session(task, host_id, session_id, runtime_data):
+def process_hosts(task, host_sessions, runtime_data, lock=None):
     """
-    Task for session-processing.
+    Task to process the sessions of multiple hosts concurrently and release
+    the host's locks afterwards. Hosts that reached a concurrency-limit are
+    retried with backoff (s. :func:`.get_retry_countdown`).
     """
-    processor = SessionProcessor(host_id, session_id, runtime_data)
-    signal.signal(signal.SIGUSR1, processor.session.stop)
-    processor.run()
+    waiting = FanoutProcessor(host_sessions, runtime_data, lock).run()
+    if lock:
+        waiting_ids = set(host_id for host_id, session_ids in waiting)
+        host_ids = set(host_id for host_id, session_ids in host_sessions)
+        for host in Host.objects.filter(id__in=host_ids - waiting_ids):
+            host.release_lock(lock)
+    if waiting:
+        if lock: Host.objects.filter(id__in=waiting_ids).renew_lock(lock)
+        args = (waiting, runtime_data, lock)
+        countdown = get_retry_countdown(task.request.retries)
+        raise task.retry(args=args, countdown=countdown, max_retries=None)
 
 @shared_task
-def cleanup(host_id):
+def cleanup(host_id, lock=None):
     """
     Task to release the host's lock.
     """
-    Host.objects.get(pk=host_id).release_lock()
+    if lock: Host.objects.get(pk=host_id).release_lock(lock)
+
+@shared_task
+def check_rollout(done_ids, pending_ids, max_failures):
+    """
+    Task to check a batch in rollout-mode. Cancel the pending sessions if more
+    than max_failures of the done sessions ended with an error. The host-locks
+    of the pending sessions are renewed beforehand.
+    """
+    pending = MinkeSession.objects.filter(id__in=pending_ids, proc_status='initialized')
+    for lock in set(pending.exclude(lock=None).values_list('lock', flat=True)):
+        Host.objects.all().renew_lock(lock)
+    if max_failures is None:
+        return
+    done = MinkeSession.objects.filter(id__in=done_ids)
+    failures = done.filter(session_status='error').count()
+    if failures <= max_failures:
+        return
+    msg = f'Rollout aborted: {failures} sessions failed.'
+    for minke_session in MinkeSession.objects.filter(id__in=pending_ids):
+        if minke_session.is_waiting:
+            minke_session.cancel()
+            minke_session.buffer(Message(msg, 'error'))
+            minke_session.flush()
+
+@shared_task(bind=True)
+def dispatch_sessions(task, dispatch_id, session_name, content_type_id, user_id,
+                      url_query, runtime_data, queue=None, priority=None):
+    """
+    Task to run sessions on the objects of a changelist. The hosts of the
+    objects are walked by their primary-keys in chunks of
+    MINKE_DISPATCH_CHUNK_SIZE. Sessions for all objects of a chunk's hosts are
+    initialized and their tasks are started before the next chunk is fetched.
+    So each host is locked and processed once. The progress is reported after
+    each chunk. Sessions in rollout-mode are dispatched in a single chunk, so
+    that all hosts are part of the same rollout.
+    """
+    # The engine imports the tasks - so we import it lazily.
+    from .engine import process
+    from .engine import set_progress
+
+    try:
+        REGISTRY.reload(session_name)
+        session_cls = REGISTRY[session_name]
+        user = User.objects.get(pk=user_id)
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        queryset = get_changelist_queryset(model, user, url_query).order_by('pk')
+        total = queryset.count()
+        set_progress(dispatch_id, total=total)
+
+        dispatched = 0
+        last_pk = None
+        hosts = queryset.get_hosts().order_by('pk').distinct()
+        rollout = session_cls.rollout_canary or session_cls.rollout_batch_size
+        chunk_size = None if rollout else settings.MINKE_DISPATCH_CHUNK_SIZE
+        while True:
+            chunk = hosts if last_pk is None else hosts.filter(pk__gt=last_pk)
+            pks = list(chunk.values_list('pk', flat=True)[:chunk_size])
+            if not pks:
+                break
+            minkeobjs = queryset.host_filter(Host.objects.filter(pk__in=pks))
+            process(session_cls, minkeobjs, user, runtime_data, queue=queue, priority=priority)
+            dispatched += minkeobjs.count()
+            last_pk = pks[-1]
+            set_progress(dispatch_id, dispatched=dispatched)
+
+    except Exception:
+        set_progress(dispatch_id, done=True, failed=True)
+        raise
+    else:
+        set_progress(dispatch_id, done=True)
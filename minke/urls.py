@@ -15,8 +15,14 @@ Including another URLconf
 """
 from django.conf.urls import url
 from .views import SessionListAPI
+from .views import SessionUpdateAPI
+from .views import SessionStreamAPI
+from .views import DispatchProgressAPI
 
 
 urlpatterns = [
+    url(r'^minkeapi/dispatch/(?P<dispatch_id>[0-9a-f]+)/', DispatchProgressAPI.as_view(), name='minke_dispatch_api'),
+    url(r'^minkeapi/sessions/stream/', SessionStreamAPI.as_view(), name='minke_session_stream_api'),
+    url(r'^minkeapi/sessions/updates/', SessionUpdateAPI.as_view(), name='minke_session_update_api'),
     url(r'^minkeapi/sessions/', SessionListAPI.as_view(), name='minke_session_api'),
 ]
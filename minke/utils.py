@@ -1,22 +1,65 @@
 # -*- coding: utf-8 -*-
 
 import json
+import zlib
+import base64
 import yaml
 from django.db import models
+from django.http import HttpRequest
+from django.http import QueryDict
+from django.urls import reverse
 from django.forms import ValidationError
 from django.core.serializers.json import DjangoJSONEncoder
 from django.utils.translation import gettext as _
 
+from . import settings
+
 
 def item_by_attr(list, attr, value, default=None):
     return next((i for i in list if hasattr(i, attr) and getattr(i, attr) == value), default)
 
 
+def get_changelist_queryset(model, user, url_query):
+    """
+    Rebuild the queryset of a changelist for a user and an url-query. Raise
+    IncorrectLookupParameters or FieldError for an invalid url-query.
+    """
+    # The admin-site is loaded with the apps - so we import it lazily.
+    from django.contrib import admin
+
+    # get a request-instance with the url-query
+    model_label = model._meta.label_lower.replace('.', '_')
+    request = HttpRequest()
+    request.method = 'GET'
+    request.path = reverse('admin:' + model_label + '_changelist')
+    request.GET = QueryDict(url_query)
+    request.user = user
+
+    # get a changelist and return its queryset
+    modeladmin = admin.site._registry[model]
+    changelist = modeladmin.get_changelist_instance(request)
+    return changelist.get_queryset(request)
+
+
 def prepare_shell_command(cmd):
     # linux-shells need \n as newline
     return cmd.replace('\r\n', '\n').replace('\r', '\n')
 
 
+# Use the libyaml-bindings if available.
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+def load_yaml_configuration(value):
+    """
+    Parse a yaml formatted fabric configuration. Return None for None or an
+    empty string.
+    """
+    if value is None or value == '':
+        return None
+    return yaml.load(value, YAML_LOADER)
+
+
 def valid_yaml_configuration(value):
     """
     This validator will be used for model- and form-fields dealing with a yaml
@@ -27,7 +70,7 @@ def valid_yaml_configuration(value):
         return
 
     try:
-        data = yaml.load(value, yaml.Loader)
+        data = load_yaml_configuration(value)
         assert(isinstance(data, dict))
     except yaml.YAMLError:
         raise ValidationError(_("Configuration must be valid yaml data."))
@@ -56,19 +99,40 @@ class JSONField(models.TextField):
         return json.dumps(value, cls=DjangoJSONEncoder)
 
 
-def get_session_summary(sessions):
+class CompressedTextField(models.TextField):
     """
-    Takes a list of sessions and extract a summary-dictonary.
+    A TextField that stores large values zlib-compressed.
+
+    Compression is only applied if MINKE_COMPRESSION is True and only to
+    values of at least min_size characters. Compressed values are stored
+    base64-encoded with a prefix to tell them from plain ones. So compression
+    could be switched on and off at any time. Be aware that the database
+    won't be able to search within compressed values.
     """
-    summary = dict()
-    summary['all'] = len(sessions)
-    summary['waiting'] = len([s for s in sessions if s.proc_status == 'initialized'])
-    summary['running'] = len([s for s in sessions if s.proc_status in ('running', 'stopping')])
-    summary['done'] = len([s for s in sessions if s.proc_status in ('completed', 'stopped', 'canceled', 'failed')])
-    summary['success'] = len([s for s in sessions if s.session_status == 'success'])
-    summary['warning'] = len([s for s in sessions if s.session_status == 'warning'])
-    summary['error'] = len([s for s in sessions if s.session_status == 'error'])
-    return summary
+    PREFIX = '\x1fzlib\x1f'
+
+    def __init__(self, *args, min_size=256, **kwargs):
+        self.min_size = min_size
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.min_size != 256:
+            kwargs['min_size'] = self.min_size
+        return name, path, args, kwargs
+
+    def from_db_value(self, value, *args):
+        if value is not None and value.startswith(self.PREFIX):
+            data = base64.b64decode(value[len(self.PREFIX):])
+            value = zlib.decompress(data).decode('utf-8')
+        return value
+
+    def get_db_prep_save(self, value, connection):
+        value = super().get_db_prep_save(value, connection)
+        if settings.MINKE_COMPRESSION and value and len(value) >= self.min_size:
+            data = zlib.compress(value.encode('utf-8'))
+            value = self.PREFIX + base64.b64encode(data).decode('ascii')
+        return value
 
 
 class FormatDict(dict):
@@ -1,17 +1,30 @@
 # -*- coding: utf-8 -*-
 
+import json
+from time import time
+from time import sleep
+
 from django.core.exceptions import FieldError
+from django.http import StreamingHttpResponse
 from django.template.loader import render_to_string
 
 from rest_framework.response import Response
+from rest_framework.renderers import BaseRenderer
+from rest_framework.renderers import JSONRenderer
+from rest_framework.views import APIView
+from rest_framework.exceptions import NotFound
 from rest_framework.generics import ListAPIView
+from rest_framework.generics import GenericAPIView
 from rest_framework.filters import BaseFilterBackend
 from rest_framework.permissions import IsAuthenticated
 
+from . import settings
+from .engine import get_progress
 from .serializers import SessionSerializer
+from .serializers import SessionUpdateSerializer
 from .exceptions import InvalidURLQuery
+from .exceptions import InvalidRequestData
 from .models import MinkeSession
-from .utils import get_session_summary
 
 
 class LookupFilter(BaseFilterBackend):
@@ -21,7 +34,7 @@ class LookupFilter(BaseFilterBackend):
     def get_lookup_params(self, request):
         params = dict()
         for k, v in request.GET.items():
-            if k == 'summary': continue
+            if k in ('summary', 'msg_id'): continue
             elif k.endswith('__in'): params[k] = v.split(',')
             else: params[k] = v
         return params
@@ -57,8 +70,7 @@ class SessionListAPI(ListAPIView):
         Either return json-formatted sessions or a html-summary-snippet.
         """
         if 'summary' in request.GET:
-            sessions = list(self.filter_queryset(self.get_queryset()))
-            summary = get_session_summary(sessions)
+            summary = self.filter_queryset(MinkeSession.objects.all()).get_summary()
             context = dict(session_count=summary)
             summary_html = render_to_string('minke/session_summary.html', context)
             return Response(summary_html)
@@ -76,3 +88,129 @@ class SessionListAPI(ListAPIView):
 
         serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
+
+
+class SessionUpdateAPI(GenericAPIView):
+    """
+    API endpoint to retrieve session-updates.
+
+    Expects a json-object that maps session-ids to the proc-status and the id
+    of the last message the client already knows of::
+
+        {"12": {"proc_status": "running", "msg_id": 345}, ...}
+
+    Only sessions with a changed proc-status or new messages are returned.
+    The messages-list of each session holds only the new messages.
+    """
+    permission_classes = (IsAuthenticated,)
+    serializer_class = SessionUpdateSerializer
+    filter_backends = (UserFilter,)
+    queryset = MinkeSession.objects.all()
+
+    def get_known_states(self, request):
+        """
+        Return a dictonary mapping session-ids to (proc-status, msg-id).
+        """
+        try:
+            return dict((int(k), (v['proc_status'], int(v.get('msg_id') or 0)))
+                        for k, v in request.data.items())
+        except (AttributeError, KeyError, TypeError, ValueError):
+            msg = 'Invalid session-states: {}'.format(request.data)
+            raise InvalidRequestData(msg)
+
+    def post(self, request, *arg, **kwargs):
+        known = self.get_known_states(request)
+        updates = self.filter_queryset(self.get_queryset()).get_updates(known)
+        serializer = self.get_serializer(updates, many=True)
+        return Response(serializer.data)
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Render data as a server-sent event. Browsers request streams with an
+    Accept-header of text/event-stream. Errors are sent as ``error`` event.
+    """
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return 'event: error\ndata: {}\n\n'.format(json.dumps(data)).encode(self.charset)
+
+
+class SessionStreamAPI(GenericAPIView):
+    """
+    API endpoint to stream session-updates as server-sent events.
+
+    Sessions are selected by the url-query (e.g. ``?id__in=12,13``). Pass
+    the id of the oldest message the client knows of as ``msg_id`` to skip
+    older messages. Each update is sent as a ``session`` event holding the
+    same data as :class:`.SessionUpdateAPI` returns per session. Once all
+    sessions are done a ``done`` event is sent and the stream ends.
+
+    The stream watches the database in intervals of MINKE_STREAM_INTERVAL
+    seconds and is closed after MINKE_STREAM_TIMEOUT seconds. Clients are
+    expected to reconnect and to ignore messages they already know of.
+
+    Each open stream occupies a worker of the application-server for up to
+    MINKE_STREAM_TIMEOUT seconds. Serve it with threaded or asynchronous
+    workers or lower the timeout for small worker-pools.
+    """
+    permission_classes = (IsAuthenticated,)
+    renderer_classes = (JSONRenderer, EventStreamRenderer)
+    serializer_class = SessionUpdateSerializer
+    filter_backends = (LookupFilter, UserFilter)
+    queryset = MinkeSession.objects.all()
+
+    def get_event(self, event, data=None):
+        return 'event: {}\ndata: {}\n\n'.format(event, json.dumps(data))
+
+    def stream(self, queryset, known):
+        timeout = time() + settings.MINKE_STREAM_TIMEOUT
+        while known and time() < timeout:
+            updates = queryset.get_updates(known)
+            for session, data in zip(updates, self.get_serializer(updates, many=True).data):
+                msg_id = max([m.id for m in session.new_messages] or [known[session.id][1]])
+                known[session.id] = (session.proc_status, msg_id)
+                if session.is_done:
+                    del known[session.id]
+                yield self.get_event('session', data)
+            if not updates:
+                # keep the connection alive
+                yield ': \n\n'
+            sleep(settings.MINKE_STREAM_INTERVAL)
+        if not known:
+            yield self.get_event('done')
+
+    def get(self, request, *arg, **kwargs):
+        try:
+            msg_id = int(request.GET.get('msg_id', 0))
+        except ValueError:
+            raise InvalidURLQuery('Invalid msg_id: {}'.format(request.GET['msg_id']))
+        queryset = self.filter_queryset(self.get_queryset())
+        known = dict((id, (None, msg_id)) for id in queryset.values_list('id', flat=True))
+        response = StreamingHttpResponse(
+            self.stream(queryset, known),
+            content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class DispatchProgressAPI(APIView):
+    """
+    API endpoint to retrieve the progress of sessions dispatched in the
+    background (s. :func:`.engine.dispatch`)::
+
+        {"total": 5000, "dispatched": 1500, "done": false, "failed": false}
+
+    The total is null as long as the objects were not counted yet.
+    """
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, dispatch_id, *arg, **kwargs):
+        progress = get_progress(dispatch_id)
+        if not progress or progress['user_id'] != request.user.id:
+            raise NotFound('Unknown dispatch: {}'.format(dispatch_id))
+        keys = ('total', 'dispatched', 'done', 'failed')
+        return Response(dict((k, progress[k]) for k in keys))
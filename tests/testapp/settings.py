@@ -78,8 +78,15 @@ WSGI_APPLICATION = 'testapp.wsgi.application'
 # https://docs.djangoproject.com/en/1.11/ref/settings/#databases
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'testapp.sqlite3',
         'NAME': ':memory:',
+        # The fanout-tests process sessions in threads, which write to the
+        # database concurrently - as they do in production. sqlite's shared
+        # in-memory-database fails on that with locked tables, while a file-
+        # based database lets the writers wait for each other (s. OPTIONS and
+        # testapp.sqlite3). Single-threaded tests behave just the same.
+        'TEST': {'NAME': os.path.join(BASE_DIR, 'test.sqlite3')},
+        'OPTIONS': {'timeout': 30},
     }
 }
 
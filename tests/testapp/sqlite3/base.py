@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    A sqlite-backend that starts transactions with an immediate write-lock.
+
+    Sessions processed in threads (fanout-mode) write concurrently to the
+    database. With deferred transactions sqlite fails on lock-upgrades with
+    "database is locked" instead of letting the writers wait for each other.
+    This is what the transaction_mode-option of django>=5.1 does - which is
+    not available for django-2.2.
+    """
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN IMMEDIATE')
@@ -1,7 +1,20 @@
+import os
+import sys
+import gzip
+import tempfile
+from time import time
+from threading import Thread
+
 from django.test import TestCase
 from django.forms import ValidationError
 
+from fabric2 import Connection
+from invoke.watchers import Responder
 from minke.fabrictools import FabricConfig
+from minke.fabrictools import ConnectionPool
+from minke.fabrictools import ConfigCache
+from minke.fabrictools import OutputBuffer
+from minke.fabrictools import FabricRemote
 from minke.models import Host
 from minke.exceptions import InvalidMinkeSetup
 
@@ -92,6 +105,7 @@ class FabricConfigTestCase(TestCase):
         # With valid yaml-data.
         with AlterObject(hostgroup, config=YAML_CONFIG):
             hostgroup.save()
+            self.assertEqual(hostgroup.config_data['foo']['bar'], 123)
             config = FabricConfig(self.host, DummySession, dict())
             self.assertTrue(config.run.pty)
             self.assertTrue(config.run.hide) # Not overwritten by yaml data
@@ -99,3 +113,251 @@ class FabricConfigTestCase(TestCase):
             self.assertTrue(hasattr(config.foo, 'bar'))
             self.assertEqual(config.foo.bar, 123)
         hostgroup.save()
+
+    def test_output_config(self):
+        config = FabricConfig(self.host, DummySession, dict())
+        self.assertIsNone(config.run.output_limit)
+        self.assertIsNone(config.run.output_dir)
+        with AlterSettings(FABRIC_RUN_OUTPUT_LIMIT=1024):
+            config = FabricConfig(self.host, DummySession, dict())
+            self.assertEqual(config.run.output_limit, 1024)
+
+    def test_config_cache(self):
+        cache = ConfigCache(2)
+        config = cache.get(self.host, DummySession, dict())
+        cache.get(self.host, DummySession, dict())
+        self.assertEqual(len(cache._configs), 1)
+        cache.get(self.host, DummySession, dict(foo='bar'))
+        self.assertEqual(len(cache._configs), 2)
+
+        # each call returns a clone - changes do not leak into the cache
+        config.connect_kwargs['key_filename'] = ['/foo/id_rsa']
+        other = cache.get(self.host, DummySession, dict())
+        self.assertIsNot(config, other)
+        self.assertNotIn('key_filename', other.connect_kwargs)
+        self.assertEqual(other.run.output_limit, config.run.output_limit)
+
+        # changed host-configs result in a new config
+        self.host.config = YAML_CONFIG
+        new_config = cache.get(self.host, DummySession, dict())
+        self.assertTrue(new_config.run.pty)
+        self.assertEqual(len(cache._configs), 2)
+
+        # saving the host drops its configs
+        self.host.save()
+        self.assertFalse(cache._configs)
+
+        # the key is based on the parsed config the cached one is built of
+        key = cache.get_key(self.host, DummySession, dict())
+        Host.objects.filter(id=self.host.id).update(config='')
+        host = Host.objects.get(id=self.host.id)
+        self.assertEqual(cache.get_key(host, DummySession, dict()), key)
+        self.assertTrue(cache.get(host, DummySession, dict()).run.pty)
+        Host.objects.filter(id=self.host.id).update(config_data=None)
+        host = Host.objects.get(id=self.host.id)
+        self.assertNotEqual(cache.get_key(host, DummySession, dict()), key)
+        self.assertFalse(cache.get(host, DummySession, dict()).run.pty)
+
+    def test_config_cache_threads(self):
+        cache = ConfigCache(2)
+        host = Host.objects.prefetch_related('groups').get(pk=self.host.pk)
+        errors = list()
+
+        def get_configs(i):
+            try:
+                for n in range(100):
+                    cache.get(host, DummySession, dict(foo=n % 3))
+                    cache.invalidate(Host, host if i % 2 else None)
+            except Exception as exc:
+                errors.append(exc)
+
+        # switch threads as often as possible to provoke races
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            threads = [Thread(target=get_configs, args=(i,)) for i in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(interval)
+        self.assertEqual(errors, list())
+
+
+class FakeTransport:
+    def __init__(self):
+        self.active = True
+        self.broken = False
+
+    def is_active(self):
+        return self.active
+
+    def send_ignore(self):
+        if self.broken:
+            raise EOFError
+
+
+class FakeClient:
+    def __init__(self):
+        self.transport = FakeTransport()
+        self.closed = False
+
+    def get_transport(self):
+        return self.transport
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_hosts()
+
+    def get_connection(self, client=None):
+        host = Host.objects.get(name='localhost')
+        config = FabricConfig(host, DummySession, dict())
+        con = Connection(host.hostname, host.username, host.port, config=config)
+        if client:
+            con.client = client
+            con.transport = client.get_transport()
+        return con
+
+    def test_get_key(self):
+        host = Host.objects.get(name='localhost')
+        pool = ConnectionPool(60)
+        config = FabricConfig(host, DummySession, dict())
+        con = Connection(host.hostname, host.username, host.port, config=config)
+        other = Connection(host.hostname, host.username, host.port, config=config)
+        self.assertEqual(pool.get_key(con), pool.get_key(other))
+
+        # different connect-kwargs must result in different keys
+        runtime_data = dict(fabric_connect_kwargs_passphrase='foobar')
+        config = FabricConfig(host, DummySession, runtime_data)
+        other = Connection(host.hostname, host.username, host.port, config=config)
+        self.assertNotEqual(pool.get_key(con), pool.get_key(other))
+
+        # unconnected connections won't be pooled
+        pool.release(con)
+        self.assertFalse(pool._clients)
+
+    def test_reuse(self):
+        pool = ConnectionPool(60)
+        client = FakeClient()
+        pool.release(self.get_connection(client))
+        self.assertFalse(client.closed)
+
+        # healthy clients are reused and owned by the new connection
+        con = pool.connect(self.get_connection())
+        self.assertIs(con.client, client)
+        self.assertIs(con.transport, client.transport)
+        self.assertFalse(pool._clients)
+
+        # a released client replaces the pooled one with the same key
+        pool.release(con)
+        other = FakeClient()
+        pool.release(self.get_connection(other))
+        self.assertTrue(client.closed)
+        self.assertFalse(other.closed)
+        self.assertEqual(len(pool._clients), 1)
+
+    def test_health_check(self):
+        pool = ConnectionPool(60)
+        client = FakeClient()
+        self.assertTrue(pool.is_healthy(client))
+        client.transport.broken = True
+        self.assertFalse(pool.is_healthy(client))
+        client.transport = None
+        self.assertFalse(pool.is_healthy(client))
+
+        # unhealthy clients are closed instead of being pooled
+        client = FakeClient()
+        client.transport.broken = True
+        pool.release(self.get_connection(client))
+        self.assertTrue(client.closed)
+        self.assertFalse(pool._clients)
+
+        # pooled clients that died in the meantime are closed and replaced
+        client = FakeClient()
+        pool.release(self.get_connection(client))
+        client.transport.active = False
+        con = pool.connect(self.get_connection())
+        self.assertTrue(client.closed)
+        self.assertIsNot(con.client, client)
+        self.assertFalse(pool._clients)
+
+    def test_reap(self):
+        pool = ConnectionPool(60)
+        client, idle = FakeClient(), FakeClient()
+        pool.release(self.get_connection(client))
+        pool._clients['idle'] = (idle, time() - 61)
+
+        # idle clients are closed whenever the pool is used
+        pool.reap()
+        self.assertTrue(idle.closed)
+        self.assertFalse(client.closed)
+        self.assertEqual(len(pool._clients), 1)
+        pool.clear()
+        self.assertTrue(client.closed)
+        self.assertFalse(pool._clients)
+
+        # without an idle-timeout clients are never pooled
+        pool = ConnectionPool(0)
+        client = FakeClient()
+        pool.release(self.get_connection(client))
+        self.assertTrue(client.closed)
+        self.assertFalse(pool._clients)
+
+
+class OutputBufferTestCase(TestCase):
+    def test_output_limit(self):
+        output = OutputBuffer(10)
+        for data in ('foo', 'bar', 'baz'):
+            output.append(data)
+        self.assertEqual(''.join(output), 'foobarbaz')
+
+        # exceed the limit
+        output.append('123456789')
+        self.assertEqual(output.dropped, 8)
+        self.assertEqual(output.head_size + output.tail_size, 10)
+        self.assertFalse(output.spilled)
+        text = ''.join(output)
+        self.assertTrue(text.startswith('fooba\n'))
+        self.assertTrue(text.endswith('\n56789'))
+        self.assertIn('8 characters omitted', text)
+
+    def test_watched_output(self):
+        output = OutputBuffer(10, watched=True)
+        remote = FabricRemote(Connection('localhost'))
+        remote.watchers = [Responder(r'password:', 'secret\n')]
+        responses = list()
+        with AlterObject(remote, write_proc_stdin=responses.append):
+            # watchers see each prompt - even beyond the limit
+            for data in ('password:', 'x' * 20, 'password:', 'password:'):
+                output.append(data)
+                remote.respond(output)
+        self.assertEqual(responses, ['secret\n'] * 3)
+        self.assertEqual(''.join(output.stream), 'password:' + 'x' * 20 + 'password:' * 2)
+        self.assertEqual(output.head_size + output.tail_size, 10)
+
+    def test_spill_to_file(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'output', 'stdout.gz')
+
+            # no file as long as the limit is not exceeded
+            output = OutputBuffer(10, path)
+            output.append('föö')
+            output.close()
+            self.assertFalse(output.spilled)
+            self.assertFalse(os.path.exists(path))
+
+            output = OutputBuffer(10, path)
+            data = ['föö', 'bär', 'baz'] * 100
+            for chunk in data:
+                output.append(chunk)
+            output.close()
+            self.assertTrue(output.spilled)
+            self.assertIn(path, ''.join(output))
+            with gzip.open(path, 'rt', encoding='utf-8') as file:
+                self.assertEqual(file.read(), ''.join(data))
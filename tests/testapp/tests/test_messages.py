@@ -41,3 +41,16 @@ class MessageTest(SimpleTestCase):
         except: message = ExceptionMessage(print_tb=True)
         self.assertRegex(message.text, 'Traceback')
         self.assertRegex(message.html, 'Traceback')
+
+    def test_02_rendered_html(self):
+        # html of pre-messages is rendered from the text on access
+        message = PreMessage('foobär')
+        self.assertIsNone(message.html_data)
+        self.assertEqual(message.html, '<pre>foobär</pre>')
+        message = TableMessage((('foobär',),))
+        self.assertIsNone(message.html_data)
+
+        # messages with their own html keep it
+        message = Message('<foobär>')
+        self.assertEqual(message.html_data, '&lt;foobär&gt;')
+        self.assertEqual(message.html, '&lt;foobär&gt;')
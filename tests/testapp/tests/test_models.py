@@ -1,12 +1,37 @@
 # -*- coding: utf-8 -*-
 
+import datetime
+
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.contrib.auth.models import User
+from django.db.models import TextField
+from django.db.models.functions import Cast
 
-from minke.models import Host, MinkeModel
+from minke import settings
+from minke.models import Host, HostLock, HostGroup, MinkeModel, MinkeSession, BaseMessage
+from minke.models import SessionSlot
+from minke.models import MinkeSessionQuerySet
+from minke.messages import PreMessage
+from minke.utils import CompressedTextField
+from minke.tasks import process_host
+from minke.tasks import check_rollout
+from minke.tasks import SessionProcessor
+from minke.tasks import LockHeartbeat
+from minke.tasks import get_retry_countdown
+from minke.exceptions import ConcurrencyLimitReached
 from minke.exceptions import InvalidMinkeSetup
 from ..models import AnySystem
+from ..sessions import LeaveAMessageSession
+from ..sessions import DummySession
+from ..models import Server
 from .utils import create_hosts
 from .utils import create_players
+from .utils import create_users
+from .utils import create_hostgroups
+from .utils import create_minkesession
+from .utils import AlterObject
 
 
 class MinkeModelTest(TestCase):
@@ -35,3 +60,339 @@ class MinkeModelTest(TestCase):
         # host-lookup should fail with InvalidMinkeSetup
         invalid_model = InvalidModel()
         self.assertRaises(InvalidMinkeSetup, invalid_model.get_host)
+
+    def test_02_resolve_hosts(self):
+        for model in (Host, Server, AnySystem):
+            with self.assertNumQueries(1 if model is Host else 2):
+                minkeobjs = model.objects.resolve_hosts()
+                hosts = [o.get_host() for o in minkeobjs]
+            self.assertTrue(minkeobjs)
+            for minkeobj, host in zip(minkeobjs, hosts):
+                self.assertEqual(host, model.objects.get(pk=minkeobj.pk).get_host())
+
+
+class MinkeSessionQuerySetTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_users()
+        create_hosts()
+
+    def test_01_get_summary(self):
+        hosts = list(Host.objects.all())
+        create_minkesession(hosts[0], status='success', proc_status='completed')
+        create_minkesession(hosts[1], status='warning', proc_status='stopped')
+        create_minkesession(hosts[2], status='error', proc_status='failed')
+        create_minkesession(hosts[3], status='success', proc_status='running')
+        create_minkesession(hosts[4], status='success', proc_status='initialized')
+
+        with self.assertNumQueries(1):
+            summary = MinkeSession.objects.get_summary()
+        self.assertEqual(summary, dict(
+            all=5, waiting=1, running=1, done=3, success=3, warning=1, error=1))
+
+        # empty querysets
+        summary = MinkeSession.objects.none().get_summary()
+        self.assertEqual(summary['all'], 0)
+
+    def test_02_get_updates(self):
+        hosts = list(Host.objects.all())
+        old = create_minkesession(hosts[0], proc_status='running')
+        new = create_minkesession(hosts[1], proc_status='running')
+        for i in range(5):
+            old.messages.add(PreMessage(str(i)), bulk=False)
+        last_id = old.messages.order_by('id').last().id
+        new.messages.add(PreMessage('foo'), bulk=False)
+        old.messages.add(PreMessage('bar'), bulk=False)
+
+        known = {old.id: ('running', last_id), new.id: ('running', 0)}
+        with CaptureQueriesContext(connection) as queries:
+            updates = MinkeSession.objects.get_updates(known)
+        updates = dict((s.id, [m.text for m in s.new_messages]) for s in updates)
+        self.assertEqual(updates, {old.id: ['bar'], new.id: ['foo']})
+
+        # a session without messages does not load the known messages of others
+        with connection.cursor() as cursor:
+            cursor.execute(queries.captured_queries[-1]['sql'])
+            self.assertEqual(len(cursor.fetchall()), 2)
+
+        # unchanged sessions are skipped
+        known = {old.id: ('running', last_id + 10), new.id: ('running', last_id + 10)}
+        self.assertEqual(MinkeSession.objects.get_updates(known), list())
+
+    def test_03_bulk_init(self):
+        user = User.objects.get(username='admin')
+        hosts = list(Host.objects.all()[:3])
+        sessions = list()
+        for host in hosts:
+            session = MinkeSession()
+            session.init(user, host, DummySession, commit=False)
+            sessions.append(session)
+
+        # another run inits sessions on the same objects meanwhile
+        bulk_create = MinkeSessionQuerySet.bulk_create
+        def concurrent_bulk_create(queryset, objs, *args, **kwargs):
+            objs = bulk_create(queryset, objs, *args, **kwargs)
+            for host in hosts:
+                create_minkesession(host, proc_status='initialized')
+            return objs
+
+        with AlterObject(MinkeSessionQuerySet, bulk_create=concurrent_bulk_create):
+            MinkeSession.objects.bulk_init(sessions, 2)
+        for host, session in zip(hosts, sessions):
+            session = MinkeSession.objects.get(pk=session.pk)
+            self.assertEqual(session.minkeobj, host)
+            self.assertEqual(session.session_name, DummySession.__name__)
+            self.assertIsNone(session.start_time)
+
+
+class HostLockTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_users()
+        create_hosts()
+
+    def test_01_lease(self):
+        hosts = Host.objects.all()
+        lock = hosts.get_lock()
+        self.assertEqual(hosts.filter(lock=lock, lock_expires__isnull=False).count(), hosts.count())
+
+        # locked hosts can't be locked again
+        self.assertEqual(hosts.filter(lock=hosts.get_lock()).count(), 0)
+
+        # expired locks are reaped
+        past = datetime.datetime.now() - datetime.timedelta(seconds=1)
+        hosts.filter(pk=hosts[0].pk).update(lock_expires=past)
+        new_lock = hosts.get_lock()
+        self.assertEqual(hosts.get(lock=new_lock), hosts[0])
+
+        # locks without expiry-time never expire
+        hosts.filter(pk=hosts[1].pk).update(lock='foobar', lock_expires=None)
+        self.assertFalse(hosts.filter(lock=hosts.get_lock()).exists())
+
+        # renewed leases are extended
+        expires = hosts.get(pk=hosts[2].pk).lock_expires
+        with AlterObject(settings, MINKE_LOCK_TIMEOUT=3600):
+            self.assertEqual(hosts.filter(pk=hosts[2].pk).renew_lock(lock), 1)
+        self.assertGreater(hosts.get(pk=hosts[2].pk).lock_expires, expires)
+        self.assertEqual(hosts.renew_lock('nolock'), 0)
+
+        # locks are only released by their holder
+        host = hosts.get(pk=hosts[2].pk)
+        host.release_lock('nolock')
+        self.assertEqual(Host.objects.get(pk=host.pk).lock, lock)
+        host.release_lock(lock)
+        self.assertIsNone(Host.objects.get(pk=host.pk).lock)
+
+    def test_02_lock_scopes(self):
+        hosts = Host.objects.filter(pk__in=Host.objects.all()[:2])
+        self.assertIsNone(hosts.get_lock('none'))
+        self.assertRaises(InvalidMinkeSetup, hosts.get_lock, 'nolock')
+
+        # locks with session-scope are per key
+        foo = hosts.get_lock('session', 'foo')
+        self.assertEqual(len(hosts.get_locked(foo)), 2)
+        self.assertEqual(len(hosts.get_locked(hosts.get_lock('session', 'foo'))), 0)
+        bar = hosts.get_lock('session', 'bar')
+        self.assertEqual(len(hosts.get_locked(bar)), 2)
+
+        # a host-scope lock could be taken meanwhile but only once
+        host_lock = hosts.get_lock('host')
+        self.assertEqual(len(hosts.get_locked(host_lock)), 2)
+        self.assertEqual(len(hosts.get_locked(hosts.get_lock('host'))), 0)
+
+        # but no exclusive lock
+        self.assertEqual(len(hosts.get_locked(hosts.get_lock())), 0)
+        for lock in (foo, bar, host_lock):
+            self.assertEqual(hosts.renew_lock(lock), 2)
+            hosts.release_lock(lock)
+        self.assertEqual(HostLock.objects.count(), 0)
+
+        # an exclusive lock blocks all others
+        lock = hosts.get_lock()
+        self.assertEqual(len(hosts.get_locked(lock)), 2)
+        for scope in ('session', 'host', 'exclusive'):
+            self.assertEqual(len(hosts.get_locked(hosts.get_lock(scope, 'foo'))), 0)
+
+        # expired locks are reaped
+        past = datetime.datetime.now() - datetime.timedelta(seconds=1)
+        hosts.release_lock(lock)
+        hosts.get_lock('host')
+        HostLock.objects.update(expires=past)
+        self.assertEqual(hosts.reap_locks(), 2)
+        self.assertEqual(HostLock.objects.count(), 0)
+
+    def test_03_lost_lock(self):
+        host = Host.objects.all()[0]
+        sessions = [create_minkesession(host, proc_status='initialized') for i in range(2)]
+        Host.objects.filter(pk=host.pk).update(lock='foobar')
+        process_host(host.pk, [s.pk for s in sessions], dict(), 'expired')
+
+        # sessions are canceled and the foreign lock is kept
+        for session in MinkeSession.objects.filter(pk__in=[s.pk for s in sessions]):
+            self.assertEqual(session.proc_status, 'canceled')
+            self.assertIn('expired', session.messages.get().text)
+        self.assertEqual(Host.objects.get(pk=host.pk).lock, 'foobar')
+
+    def test_04_waiting_sessions(self):
+        hosts = Host.objects.filter(pk__in=Host.objects.all()[:2])
+        lock = hosts.get_lock()
+        host_lock = Host.objects.filter(pk=Host.objects.last().pk).get_lock('host')
+        session = create_minkesession(hosts[0], proc_status='initialized')
+        MinkeSession.objects.filter(pk=session.pk).update(lock=lock)
+        create_minkesession(hosts[1], proc_status='initialized')
+        MinkeSession.objects.filter(lock=None, proc_status='initialized').update(lock=host_lock)
+
+        # expired locks of waiting sessions are kept
+        past = datetime.datetime.now() - datetime.timedelta(seconds=1)
+        Host.objects.filter(lock=lock).update(lock_expires=past)
+        HostLock.objects.update(expires=past)
+        self.assertEqual(Host.objects.all().reap_locks(), 0)
+        self.assertEqual(len(hosts.get_locked(lock)), 2)
+
+        # but only for MINKE_LOCK_QUEUE_TIMEOUT seconds
+        with AlterObject(settings, MINKE_LOCK_QUEUE_TIMEOUT=0):
+            self.assertEqual(hosts.filter(pk=hosts[0].pk).reap_locks(), 1)
+        self.assertEqual(len(hosts.get_locked(lock)), 1)
+
+        # pending rollout-batches renew their locks
+        check_rollout([], [session.pk], None)
+        self.assertGreater(hosts.get(pk=hosts[1].pk).lock_expires, datetime.datetime.now())
+
+        # and reaped as soon as no session is waiting anymore
+        MinkeSession.objects.update(proc_status='canceled')
+        self.assertEqual(Host.objects.all().reap_locks(), 1)
+        self.assertEqual(HostLock.objects.count(), 0)
+
+    def test_05_heartbeat(self):
+        hosts = Host.objects.filter(pk__in=Host.objects.all()[:3])
+        lock = hosts.get_lock()
+        slot = SessionSlot.objects.acquire(dict(foo=1))
+        past = datetime.datetime.now() - datetime.timedelta(seconds=1)
+        hosts.update(lock_expires=past)
+        SessionSlot.objects.update(expires=past)
+
+        # a single heartbeat renews the leases of multiple hosts
+        heartbeat = LockHeartbeat()
+        for host in hosts:
+            heartbeat.add(host.pk, lock)
+        heartbeat.add(hosts[0].pk, None, slot)
+        heartbeat.remove(hosts[2].pk, lock)
+        with self.assertNumQueries(3):
+            heartbeat.renew()
+        now = datetime.datetime.now()
+        self.assertEqual(hosts.filter(lock_expires__gt=now).count(), 2)
+        self.assertTrue(SessionSlot.objects.filter(expires__gt=now).exists())
+
+
+class SessionSlotTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_users()
+        create_hosts()
+        create_hostgroups()
+
+    def test_01_acquire(self):
+        limits = dict(foo=2, bar=1)
+        slot = SessionSlot.objects.acquire(limits)
+        self.assertTrue(slot)
+        self.assertEqual(SessionSlot.objects.filter(holder=slot).count(), 2)
+
+        # bar is exhausted - nothing is acquired at all
+        self.assertIsNone(SessionSlot.objects.acquire(limits))
+        self.assertEqual(SessionSlot.objects.count(), 2)
+        self.assertTrue(SessionSlot.objects.acquire(dict(foo=2)))
+        self.assertIsNone(SessionSlot.objects.acquire(dict(foo=2)))
+
+        # released and expired slots are free again
+        SessionSlot.objects.release(slot)
+        self.assertTrue(SessionSlot.objects.acquire(limits))
+        past = datetime.datetime.now() - datetime.timedelta(seconds=1)
+        SessionSlot.objects.update(expires=past)
+        self.assertTrue(SessionSlot.objects.acquire(dict(foo=1)))
+        self.assertEqual(SessionSlot.objects.count(), 1)
+
+    def test_02_limits(self):
+        group = HostGroup.objects.get(name='group-one')
+        host = Host.objects.filter(groups=group)[0]
+        session = create_minkesession(host, LeaveAMessageSession, proc_status='initialized')
+        HostGroup.objects.filter(pk=group.pk).update(max_sessions=1)
+        SessionSlot.objects.acquire({'hostgroup:{}'.format(group.id): 1})
+
+        processor = SessionProcessor(host.id, [session.id], dict())
+        self.assertRaises(ConcurrencyLimitReached, processor.run)
+        self.assertTrue(MinkeSession.objects.get(pk=session.pk).is_waiting)
+
+        # sessions are processed as soon as there is a free slot
+        SessionSlot.objects.all().delete()
+        with AlterObject(LeaveAMessageSession, max_sessions=1):
+            with AlterObject(settings, MINKE_MAX_SESSIONS=1):
+                processor = SessionProcessor(host.id, [session.id], dict())
+                self.assertEqual(len(processor.get_limits()), 3)
+                processor.run()
+        self.assertEqual(MinkeSession.objects.get(pk=session.pk).proc_status, 'completed')
+        self.assertEqual(SessionSlot.objects.count(), 0)
+
+    def test_03_retry_backoff(self):
+        with AlterObject(settings, MINKE_CONCURRENCY_RETRY_INTERVAL=4):
+            with AlterObject(settings, MINKE_CONCURRENCY_RETRY_MAX_INTERVAL=30):
+                self.assertTrue(2 <= get_retry_countdown(0) <= 4)
+                self.assertTrue(8 <= get_retry_countdown(2) <= 16)
+                self.assertTrue(15 <= get_retry_countdown(3) <= 30)
+                self.assertTrue(15 <= get_retry_countdown(1000) <= 30)
+
+
+class CompressedTextFieldTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_users()
+        create_hosts()
+
+    def test_01_compression(self):
+        session = create_minkesession(Host.objects.all()[0])
+        text = 'foobär\n' * 100
+        with AlterObject(settings, MINKE_COMPRESSION=True):
+            session.messages.add(PreMessage(text), PreMessage('foobär'), bulk=False)
+
+        # large values are stored compressed, small ones as they are
+        raw = BaseMessage.objects.order_by('id').annotate(raw=Cast('text', TextField()))
+        raw = list(raw.values_list('raw', flat=True))
+        self.assertTrue(raw[0].startswith(CompressedTextField.PREFIX))
+        self.assertLess(len(raw[0]), len(text))
+        self.assertEqual(raw[1], 'foobär')
+
+        # but are loaded decompressed
+        messages = list(session.messages.all())
+        self.assertEqual(messages[0].text, text)
+        self.assertEqual(messages[1].text, 'foobär')
+        self.assertEqual(messages[1].html, '<pre>foobär</pre>')
+
+
+class IndexTest(TestCase):
+    """
+    Check that our hot queries make use of the indexes.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        create_users()
+        create_hosts()
+
+    def assertUsesIndex(self, queryset, index):
+        self.assertIn(index, queryset.explain())
+
+    def test_01_session_indexes(self):
+        user = User.objects.get(username='admin')
+        hosts = Host.objects.all()
+        for host in hosts:
+            create_minkesession(host)
+
+        currents = MinkeSession.objects.get_currents(user, hosts)
+        self.assertUsesIndex(currents, 'minke_session_current_idx')
+        delta = datetime.datetime.now() - datetime.timedelta(days=30)
+        # minkeadm deletes old sessions, which implies an unordered query
+        old_sessions = MinkeSession.objects.filter(created_time__lte=delta).order_by()
+        self.assertUsesIndex(old_sessions, 'minke_session_created_idx')
+
+    def test_02_message_and_command_indexes(self):
+        session = create_minkesession(Host.objects.all()[0])
+        self.assertUsesIndex(session.messages.all(), 'minke_message_session_idx')
+        self.assertUsesIndex(session.commands.all(), 'minke_command_session_idx')
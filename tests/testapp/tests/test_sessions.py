@@ -6,17 +6,23 @@ from django.test import tag
 from django.contrib.auth.models import Permission
 from django.contrib.auth.models import User
 
+from minke import engine
 from minke import sessions
+from minke import settings
 from minke.sessions import Session
 from minke.exceptions import InvalidMinkeSetup
 from minke.exceptions import SessionRegistrationError
 from minke.models import Host
+from minke.models import CommandResult
+from minke.models import RegistryGeneration
 from ..models import Server
 from ..sessions import MethodTestSession
 from ..sessions import RunCommands
 from ..sessions import RunSessions
 from .utils import create_test_data
 from .utils import create_session
+from .utils import create_minkesession
+from .utils import AlterObject
 
 
 class SessionTest(TestCase):
@@ -113,6 +119,7 @@ class SessionTest(TestCase):
         data = dict(test='execute')
         session = create_session(MethodTestSession, self.server, data)
         session.process()
+        session.flush()
         self.assertEqual(session._db.messages.all()[0].level, 'info')
         self.assertEqual(session._db.messages.all()[1].level, 'warning')
         self.assertEqual(session._db.messages.all()[2].level, 'error')
@@ -136,6 +143,7 @@ class SessionTest(TestCase):
         data = dict(test='update_regex_fails')
         session = create_session(MethodTestSession, self.server, data)
         session.process()
+        session.flush()
         self.assertEqual(session._db.messages.all()[0].level, 'error')
         self.assertRegex(session._db.messages.all()[0].text, 'code\[0\] +echo "foobär"\n')
 
@@ -157,30 +165,173 @@ class SessionTest(TestCase):
     def test_06_more_sessions(self):
         session = create_session(RunCommands, self.server)
         session.process()
+        session.flush()
         self.assertEqual(session.status, 'error')
         self.assertEqual(len(session._db.messages.all()), 3)
         session = create_session(RunCommands, self.server)
         session.break_states = ('warning',)
         session.process()
+        session.flush()
         self.assertEqual(session.status, 'warning')
         self.assertEqual(len(session._db.messages.all()), 2)
         session = create_session(RunCommands, self.server)
         session.break_states = ('success',)
         session.process()
+        session.flush()
         self.assertEqual(session.status, 'success')
         self.assertEqual(len(session._db.messages.all()), 1)
 
         session = create_session(RunSessions, self.server)
         session.process()
+        session.flush()
         self.assertEqual(session.status, 'error')
         self.assertEqual(len(session._db.messages.all()), 7)
         session = create_session(RunSessions, self.server)
         session.break_states = ('warning',)
         session.process()
+        session.flush()
         self.assertEqual(session.status, 'warning')
         self.assertEqual(len(session._db.messages.all()), 5)
         session = create_session(RunSessions, self.server)
         session.break_states = ('success',)
         session.process()
+        session.flush()
         self.assertEqual(session.status, 'success')
         self.assertEqual(len(session._db.messages.all()), 3)
+
+    def test_07_buffered_messages(self):
+        session = create_session(MethodTestSession, self.server, dict())
+        with AlterObject(settings, MINKE_BUFFER_SIZE=3, MINKE_BUFFER_INTERVAL=60):
+            # the first message is flushed at once
+            session.add_msg('foo')
+            self.assertEqual(session._db.messages.count(), 1)
+
+            # further messages are flushed when the buffer is full
+            session.add_msg('bar')
+            session.add_msg('baz')
+            self.assertEqual(session._db.messages.count(), 1)
+            session.add_msg('foobar')
+            self.assertEqual(session._db.messages.count(), 4)
+
+            # pending messages are flushed before a remote-command is run
+            session.add_msg('foobaz')
+            self.assertEqual(session._db.messages.count(), 4)
+            counts = list()
+            def run(cmd, **kwargs):
+                counts.append(session._db.messages.count())
+                return CommandResult(command=cmd, exited=0, stdout='', stderr='', pty=False)
+            with AlterObject(session._c, run=run):
+                session.run('true')
+            self.assertEqual(counts, [5])
+
+            # the rest is flushed at the end of the session
+            session.add_msg('barfoo')
+            self.assertEqual(session._db.messages.count(), 5)
+            self.assertEqual(session._db.commands.count(), 0)
+            session.start()
+            session.end()
+            self.assertEqual(session._db.messages.count(), 6)
+            self.assertEqual(session._db.commands.count(), 1)
+
+        texts = [m.text for m in session._db.messages.all()]
+        self.assertEqual(texts, ['foo', 'bar', 'baz', 'foobar', 'foobaz', 'barfoo'])
+
+    def test_08_routing(self):
+        self.assertEqual(engine.get_routing(RunCommands), dict())
+        with AlterObject(RunCommands, queue='bulk', priority=0):
+            routing = engine.get_routing(RunCommands)
+            self.assertEqual(routing, dict(queue='bulk', priority=0))
+            routing = engine.get_routing(RunCommands, 'interactive', 9)
+            self.assertEqual(routing, dict(queue='interactive', priority=9))
+
+        # tasks are routed alike
+        signature = engine.process_host.si(1, [1], None).set(**routing)
+        self.assertEqual(signature.options, routing)
+
+    def test_09_registry_generation(self):
+        registry = sessions.RegistryDict()
+        reloads = list()
+        def receiver(sender, session_name, **kwargs):
+            reloads.append(session_name)
+        sessions.RegistryDict.reload_sessions.connect(receiver)
+
+        try:
+            # dynamic sessions are only loaded once per generation
+            registry.reload()
+            registry.reload()
+            self.assertEqual(reloads, [None])
+
+            # unless an unknown session is requested
+            registry.reload('UnknownSession')
+            self.assertEqual(reloads, [None, 'UnknownSession'])
+
+            # or a new generation was started
+            registry.changed()
+            registry.reload()
+            self.assertEqual(reloads, [None, 'UnknownSession', None])
+            registry.reload(force=True)
+            self.assertEqual(len(reloads), 4)
+
+            # generations are shared by the database
+            generation = registry.generation
+            sessions.RegistryDict().changed()
+            self.assertNotEqual(RegistryGeneration.objects.get().generation, generation)
+            registry.reload()
+            self.assertEqual(len(reloads), 5)
+        finally:
+            sessions.RegistryDict.reload_sessions.disconnect(receiver)
+
+    def test_10_create_permissions(self):
+        Permission.objects.filter(codename__startswith='run_').delete()
+        auto_sessions = [s for s in sessions.REGISTRY.values() if s.auto_permission]
+
+        # missing permissions are created in bulk
+        created = sessions.REGISTRY.create_permissions()
+        self.assertEqual(len(created), len(auto_sessions))
+        for session_cls in auto_sessions:
+            codename, _, _ = session_cls._get_permission()
+            self.assertTrue(Permission.objects.filter(codename=codename).exists())
+
+        # existing ones are left untouched
+        with self.assertNumQueries(1):
+            self.assertEqual(sessions.REGISTRY.create_permissions(), list())
+
+    def test_11_collect_results(self):
+        sessions_ = [create_minkesession(self.server) for i in range(3)]
+
+        class FakeResult:
+            def __init__(self, id, polls):
+                self.id = id
+                self.polls = polls
+            def ready(self):
+                self.polls -= 1
+                return self.polls < 0
+
+        class FakeResultSet:
+            supports_native_join = False
+            def __init__(self, results):
+                self.results = results
+            def join_native(self, callback, **kwargs):
+                for result in reversed(self.results):
+                    callback(result.id, None)
+
+        def get_results():
+            return [
+                (FakeResult('first', 2), [sessions_[0].id, sessions_[1].id]),
+                (FakeResult('second', 0), [sessions_[2].id])]
+
+        # native joins call back in the order the tasks are done
+        collected = list()
+        with AlterObject(FakeResultSet, supports_native_join=True):
+            with AlterObject(engine, ResultSet=FakeResultSet):
+                engine.collect_results(get_results(), collected.append)
+        self.assertEqual(collected[0].id, sessions_[2].id)
+        self.assertEqual(set(s.id for s in collected), set(s.id for s in sessions_))
+
+        # without native joins the pending results are polled
+        collected, sleeps = list(), list()
+        with AlterObject(engine, ResultSet=FakeResultSet, sleep=sleeps.append):
+            engine.collect_results(get_results(), collected.append)
+        self.assertEqual(collected[0].id, sessions_[2].id)
+        self.assertEqual(set(s.id for s in collected), set(s.id for s in sessions_))
+        self.assertEqual(sleeps, [settings.MINKE_RESULT_INTERVAL])
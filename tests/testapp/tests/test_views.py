@@ -2,14 +2,24 @@
 
 import json
 import re
+import sys
+from threading import Thread
 
+from django.contrib import admin
 from django.contrib.auth.models import User
+from django.contrib.auth.models import Permission
 from django.contrib.contenttypes.models import ContentType
 from django.test import TestCase
+from django.test import RequestFactory
+from django.test import TransactionTestCase
 from django.urls import reverse
 
 from minke import settings
+from minke.admin import SESSION_OPTIONS
+from minke.admin import SessionOptionsCache
+from minke.filters import StatusFilter
 from minke.models import MinkeSession
+from minke.sessions import REGISTRY
 from minke.messages import PreMessage
 from ..sessions import LeaveAMessageSession
 from ..sessions import DummySession
@@ -18,6 +28,7 @@ from ..models import Host, Server, AnySystem
 from ..forms import TestForm
 from .utils import create_test_data
 from .utils import create_minkesession
+from .utils import AlterObject
 
 
 class ViewsTest(TestCase):
@@ -217,6 +228,17 @@ class ViewsTest(TestCase):
             matches = re.findall('<tr class="minkeobj[^"]+completed[^"]*">', resp.content.decode('utf-8'))
             self.assertEqual(len(matches), count)
 
+        # the filter is applied by a single query
+        request = RequestFactory().get(baseurl)
+        request.user = self.admin
+        modeladmin = admin.site._registry[Host]
+        params = dict(minkestatus='warning,error')
+        status_filter = StatusFilter(request, params, Host, modeladmin)
+        self.assertTrue(status_filter.has_output())
+        with self.assertNumQueries(1):
+            hosts = list(status_filter.queryset(request, Host.objects.all()))
+        self.assertEqual(len(hosts), 6)
+
         self.client.logout()
 
     def test_06_session_api(self):
@@ -254,3 +276,314 @@ class ViewsTest(TestCase):
         self.assertEqual(resp.accepted_media_type, 'application/json')
         content = json.loads(resp.content.decode('utf-8'))
         self.assertEqual(content, list())
+
+    def test_07_skip_disabled_and_locked_hosts(self):
+        url = reverse('admin:minke_host_changelist')
+        hosts = Host.objects.all()[:3]
+        Host.objects.filter(pk=hosts[0].pk).update(disabled=True)
+        Host.objects.filter(pk=hosts[1].pk).update(lock='foobar')
+        post_data = dict()
+        post_data['session'] = LeaveAMessageSession.__name__
+        post_data['run_sessions'] = True
+        post_data['_selected_action'] = [h.pk for h in hosts]
+
+        self.client.force_login(self.admin)
+        resp = self.client.post(url, post_data, follow=True)
+        self.assertEqual(resp.status_code, 200)
+
+        sessions = MinkeSession.objects.get_currents(self.admin, Host.objects.all())
+        self.assertEqual(sessions.count(), 3)
+        for host, text in zip(hosts[:2], ('disabled', 'locked')):
+            session = sessions.get(minkeobj_id=host.pk)
+            self.assertEqual(session.proc_status, 'canceled')
+            self.assertEqual(session.session_status, 'error')
+            self.assertIn(text, session.messages.get().text)
+        session = sessions.get(minkeobj_id=hosts[2].pk)
+        self.assertEqual(session.proc_status, 'completed')
+        self.assertEqual(session.messages.get().text, LeaveAMessageSession.MSG)
+        self.client.logout()
+
+    def test_08_multiple_sessions_per_host(self):
+        url = reverse('admin:testapp_anysystem_changelist')
+        server = Server.objects.all()[0]
+        for i in range(3):
+            AnySystem.objects.create(server=server)
+        systems = AnySystem.objects.filter(server=server)
+        post_data = dict()
+        post_data['session'] = LeaveAMessageSession.__name__
+        post_data['run_sessions'] = True
+        post_data['_selected_action'] = [s.pk for s in systems]
+
+        self.client.force_login(self.admin)
+        resp = self.client.post(url, post_data, follow=True)
+        self.assertEqual(resp.status_code, 200)
+
+        sessions = MinkeSession.objects.get_currents(self.admin, systems)
+        self.assertEqual(sessions.count(), 4)
+        for session in sessions:
+            self.assertEqual(session.proc_status, 'completed')
+        self.assertIsNone(Host.objects.get(pk=server.host.pk).lock)
+        self.client.logout()
+
+    def test_09_session_update_api(self):
+        servers = list(Server.objects.filter(hostname__contains='222'))
+        sessions = list()
+        for server in servers:
+            session = create_minkesession(server, user='anyuser', proc_status='running')
+            session.messages.add(PreMessage('foo'), bulk=False)
+            sessions.append(session)
+
+        # the client knows all sessions as running with all messages
+        url = reverse('minke_session_update_api')
+        states = dict()
+        for session in sessions:
+            msg_id = session.messages.last().id
+            states[session.id] = dict(proc_status='running', msg_id=msg_id)
+
+        self.client.force_login(self.anyuser)
+        resp = self.client.post(url, json.dumps(states), content_type='application/json')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(json.loads(resp.content.decode('utf-8')), list())
+
+        # add a message to the first and complete the second session
+        sessions[0].messages.add(PreMessage('bär'), bulk=False)
+        MinkeSession.objects.filter(pk=sessions[1].pk).update(proc_status='completed')
+        resp = self.client.post(url, json.dumps(states), content_type='application/json')
+        content = json.loads(resp.content.decode('utf-8'))
+        content = dict((s['id'], s) for s in content)
+        self.assertEqual(len(content), 2)
+        self.assertEqual(len(content[sessions[0].id]['messages']), 1)
+        self.assertIn('bär', content[sessions[0].id]['messages'][0]['html'])
+        self.assertEqual(content[sessions[1].id]['messages'], list())
+        self.assertTrue(content[sessions[1].id]['is_done'])
+
+        # invalid request-data
+        resp = self.client.post(url, json.dumps([1, 2]), content_type='application/json')
+        self.assertEqual(resp.status_code, 400)
+        self.client.logout()
+
+        # other users won't get any updates
+        self.client.force_login(self.admin)
+        resp = self.client.post(url, json.dumps(states), content_type='application/json')
+        self.assertEqual(json.loads(resp.content.decode('utf-8')), list())
+        self.client.logout()
+
+    def test_10_session_stream_api(self):
+        servers = list(Server.objects.filter(hostname__contains='222'))
+        sessions = list()
+        for server in servers:
+            session = create_minkesession(server, user='anyuser', proc_status='completed')
+            session.messages.add(PreMessage('foo'), bulk=False)
+            sessions.append(session)
+
+        # all sessions are done - so we get each session once and a done-event
+        ids = ','.join(str(s.id) for s in sessions)
+        url = reverse('minke_session_stream_api') + '?id__in=' + ids
+        self.client.force_login(self.anyuser)
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp['Content-Type'], 'text/event-stream')
+        events = b''.join(resp.streaming_content).decode('utf-8').strip().split('\n\n')
+        self.assertEqual(len(events), len(sessions) + 1)
+        self.assertTrue(events[-1].startswith('event: done'))
+        for event in events[:-1]:
+            event, data = event.split('\n')
+            self.assertEqual(event, 'event: session')
+            data = json.loads(data[6:])
+            self.assertTrue(data['is_done'])
+            self.assertEqual(len(data['messages']), 1)
+
+        # messages the client already knows of are skipped
+        msg_id = max(s.messages.last().id for s in sessions)
+        resp = self.client.get(url + '&msg_id={}'.format(msg_id))
+        events = b''.join(resp.streaming_content).decode('utf-8').strip().split('\n\n')
+        for event in events[:-1]:
+            self.assertEqual(json.loads(event.split('\n')[1][6:])['messages'], list())
+
+        # invalid msg_id
+        resp = self.client.get(url + '&msg_id=foo')
+        self.assertEqual(resp.status_code, 400)
+
+        # browsers request the stream as text/event-stream
+        resp = self.client.get(url, HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp['Content-Type'], 'text/event-stream')
+        events = b''.join(resp.streaming_content).decode('utf-8').strip().split('\n\n')
+        self.assertTrue(events[-1].startswith('event: done'))
+        resp = self.client.get(url + '&msg_id=foo', HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(resp.status_code, 400)
+        self.assertTrue(resp.content.decode('utf-8').startswith('event: error'))
+        self.client.logout()
+
+    def test_11_rollout(self):
+        url = reverse('admin:minke_host_changelist')
+        hosts = Host.objects.all()[:4]
+        post_data = dict()
+        post_data['session'] = ExceptionSession.__name__
+        post_data['run_sessions'] = True
+        post_data['_selected_action'] = [h.pk for h in hosts]
+        self.client.force_login(self.admin)
+
+        # the canary fails and the remaining batches are canceled
+        with AlterObject(ExceptionSession, rollout_canary=1, rollout_batch_size=2, rollout_max_failures=0):
+            resp = self.client.post(url, post_data, follow=True)
+        self.assertEqual(resp.status_code, 200)
+        sessions = MinkeSession.objects.get_currents(self.admin, hosts)
+        self.assertEqual(sessions.filter(proc_status='failed').count(), 1)
+        self.assertEqual(sessions.filter(proc_status='canceled').count(), 3)
+        for session in sessions.filter(proc_status='canceled'):
+            self.assertIn('Rollout aborted', session.messages.get().text)
+
+        # all batches are processed as long as the threshold is not exceeded
+        with AlterObject(ExceptionSession, rollout_batch_size=0.5, rollout_max_failures=4):
+            resp = self.client.post(url, post_data, follow=True)
+        sessions = MinkeSession.objects.get_currents(self.admin, hosts)
+        self.assertEqual(sessions.filter(proc_status='failed').count(), 4)
+        self.assertFalse(Host.objects.filter(pk__in=[h.pk for h in hosts]).exclude(lock=None).exists())
+        self.client.logout()
+
+
+    def test_13_cached_session_options(self):
+        modeladmin = admin.site._registry[Host]
+        request = RequestFactory().get('/')
+        request.user = User.objects.get(pk=self.anyuser.pk)
+        REGISTRY.reload()
+
+        # options are build once
+        options = modeladmin.get_session_options(request)
+        names = [name for name, label in options[0]]
+        self.assertNotIn(LeaveAMessageSession.__name__, names)
+        with AlterObject(modeladmin, build_session_options=None):
+            self.assertEqual(modeladmin.get_session_options(request), options)
+
+        # and rebuild if the user's permissions changed
+        codename, _, _ = LeaveAMessageSession._get_permission()
+        self.anyuser.user_permissions.add(Permission.objects.get(codename=codename))
+        request.user = User.objects.get(pk=self.anyuser.pk)
+        options = modeladmin.get_session_options(request)
+        names = [name for name, label in options[0]]
+        self.assertIn(LeaveAMessageSession.__name__, names)
+
+        # or the registry was reloaded with a new generation
+        REGISTRY.changed()
+        REGISTRY.reload()
+        key = modeladmin.get_session_options_key(request)
+        self.assertNotIn(key, SESSION_OPTIONS._options)
+        modeladmin.get_session_options(request)
+        self.assertIn(key, SESSION_OPTIONS._options)
+
+    def test_14_dispatch_select_across(self):
+        url = reverse('admin:minke_host_changelist') + '?disabled__exact=0'
+        Host.objects.filter(pk=Host.objects.first().pk).update(disabled=True)
+        hosts = Host.objects.filter(disabled=False)
+        post_data = dict()
+        post_data['session'] = LeaveAMessageSession.__name__
+        post_data['run_sessions'] = True
+        post_data['select_across'] = 1
+        post_data['minke_form'] = True
+        post_data['_selected_action'] = [hosts[0].pk]
+        self.client.force_login(self.admin)
+
+        # sessions are dispatched in chunks for all objects of the changelist
+        with AlterObject(settings, MINKE_DISPATCH_CHUNK_SIZE=2):
+            resp = self.client.post(url, post_data, follow=True)
+        self.assertEqual(resp.status_code, 200)
+        sessions = MinkeSession.objects.get_currents(self.admin, Host.objects.all())
+        self.assertEqual(sessions.count(), hosts.count())
+        self.assertFalse(sessions.exclude(proc_status='completed').exists())
+
+        # the progress could be watched by the api
+        dispatch_id = resp.context['minke_dispatch']
+        self.assertIn('data-id="{}"'.format(dispatch_id), resp.content.decode('utf-8'))
+        resp = self.client.get(reverse('minke_dispatch_api', args=[dispatch_id]))
+        self.assertEqual(resp.status_code, 200)
+        progress = dict(total=hosts.count(), dispatched=hosts.count(), done=True, failed=False)
+        self.assertEqual(json.loads(resp.content.decode('utf-8')), progress)
+
+        # but only by the user who dispatched the sessions
+        self.client.force_login(self.anyuser)
+        resp = self.client.get(reverse('minke_dispatch_api', args=[dispatch_id]))
+        self.assertEqual(resp.status_code, 404)
+
+        # objects sharing a host are dispatched within the same chunk - so
+        # the host is locked only once
+        for server in Server.objects.all():
+            AnySystem.objects.create(server=server)
+        systems = AnySystem.objects.all()
+        url = reverse('admin:testapp_anysystem_changelist')
+        post_data['_selected_action'] = [systems[0].pk]
+        self.client.force_login(self.admin)
+        with AlterObject(settings, MINKE_DISPATCH_CHUNK_SIZE=3):
+            resp = self.client.post(url, post_data, follow=True)
+        sessions = MinkeSession.objects.get_currents(self.admin, systems)
+        enabled = systems.filter(server__host__disabled=False)
+        self.assertEqual(sessions.filter(proc_status='completed').count(), enabled.count())
+        for session in sessions.filter(proc_status='canceled'):
+            self.assertIn('disabled', session.messages.get().text)
+        resp = self.client.get(reverse('minke_dispatch_api', args=[resp.context['minke_dispatch']]))
+        self.assertEqual(json.loads(resp.content.decode('utf-8'))['dispatched'], systems.count())
+
+        # a rollout spans all chunks - there is only a single canary
+        post_data['session'] = ExceptionSession.__name__
+        post_data['_selected_action'] = [hosts[0].pk]
+        url = reverse('admin:minke_host_changelist') + '?disabled__exact=0'
+        rollout = dict(rollout_canary=1, rollout_batch_size=2, rollout_max_failures=0)
+        with AlterObject(settings, MINKE_DISPATCH_CHUNK_SIZE=2):
+            with AlterObject(ExceptionSession, **rollout):
+                resp = self.client.post(url, post_data, follow=True)
+        sessions = MinkeSession.objects.get_currents(self.admin, hosts)
+        self.assertEqual(sessions.filter(proc_status='failed').count(), 1)
+        self.assertEqual(sessions.filter(proc_status='canceled').count(), hosts.count() - 1)
+        self.client.logout()
+
+    def test_15_session_options_cache_threads(self):
+        cache = SessionOptionsCache(2)
+        errors = list()
+
+        def get_options():
+            try:
+                for n in range(200):
+                    self.assertEqual(cache.get(n % 3, lambda: n % 3), n % 3)
+            except Exception as exc:
+                errors.append(exc)
+
+        # switch threads as often as possible to provoke races
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            threads = [Thread(target=get_options) for i in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(interval)
+        self.assertEqual(errors, list())
+
+class FanoutTest(TransactionTestCase):
+    # Sessions are processed in threads with database-connections of their
+    # own. So they need to see committed data.
+    def setUp(self):
+        create_test_data()
+        self.admin = User.objects.get(username='admin')
+
+    def test_01_fanout(self):
+        url = reverse('admin:minke_host_changelist')
+        hosts = Host.objects.all()[:3]
+        post_data = dict()
+        post_data['session'] = LeaveAMessageSession.__name__
+        post_data['run_sessions'] = True
+        post_data['_selected_action'] = [h.pk for h in hosts]
+        self.client.force_login(self.admin)
+
+        # at most MINKE_FANOUT_THREADS hosts are processed at once
+        with AlterObject(LeaveAMessageSession, fanout=3):
+            with AlterObject(settings, MINKE_FANOUT_THREADS=2):
+                resp = self.client.post(url, post_data, follow=True)
+        self.assertEqual(resp.status_code, 200)
+        sessions = MinkeSession.objects.get_currents(self.admin, hosts)
+        self.assertEqual(sessions.filter(proc_status='completed').count(), 3)
+        for session in sessions:
+            self.assertEqual(session.messages.get().text, LeaveAMessageSession.MSG)
+        self.assertFalse(Host.objects.filter(pk__in=[h.pk for h in hosts]).exclude(lock=None).exists())
+        self.client.logout()
@@ -66,8 +66,7 @@ def create_users():
 
 def create_permissions():
     REGISTRY.reload()
-    for session_cls in REGISTRY.values():
-        permission, created = session_cls.create_permission()
+    REGISTRY.create_permissions()
 
 def create_hosts():
     # create a localhost with the current user